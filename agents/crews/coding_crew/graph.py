@@ -1,9 +1,77 @@
-from typing import Any, Dict
+import os
+import functools
+import logging
+import sqlite3
+import orjson
+from typing import Any, Dict, Optional
 from langgraph.graph import StateGraph, END
+from langgraph.serde.jsonplus import JsonPlusSerializer
+from config.keys import GATEWAY_API_BASE, GEMINI_API_KEYS
 from core.rotator import GeminiKeyRotator
 from agents.crews.coding_crew.state import CodingCrewState
 from agents.crews.coding_crew.nodes import CodingCrewNodes
 
+logger = logging.getLogger(__name__)
+
+# [Stability] Opt-in: persist graph state per task so a crash resumes at the last node boundary.
+# The state holds file contents, tool output and message history, so nothing is written unless
+# COMPILE_CHECKPOINT_DB names a database file; finished threads are deleted again
+CHECKPOINT_DB = os.getenv("COMPILE_CHECKPOINT_DB") or None
+
+# Dates and dataclasses go through JsonPlus' own encoding so they revive to the same types
+_ORJSON_OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_SUBCLASS
+
+class OrjsonSerializer(JsonPlusSerializer):
+    """[Optimization] JsonPlusSerializer wire format, encoded/decoded with orjson."""
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj, default=self._default, option=_ORJSON_OPTS)
+
+    def loads(self, data: bytes) -> Any:
+        return self._revive(orjson.loads(data))
+
+    def _revive(self, value: Any) -> Any:
+        # Bottom-up, same order as json.loads(object_hook=...)
+        if isinstance(value, dict):
+            return self._reviver({k: self._revive(v) for k, v in value.items()})
+        if isinstance(value, list):
+            return [self._revive(v) for v in value]
+        return value
+
+def create_checkpointer(db_path: Optional[str] = CHECKPOINT_DB) -> Any:
+    """
+    Returns an async SQLite checkpointer, or None when checkpointing is not configured. Invoke
+    the compiled graph with config={"configurable": {"thread_id": task_id}} so resumption is keyed by task.
+    """
+    if not db_path:
+        return None
+    try:
+        from langgraph.checkpoint.aiosqlite import AsyncSqliteSaver
+    except ImportError:
+        logger.warning("AsyncSqliteSaver unavailable (install aiosqlite). Checkpointing disabled.")
+        return None
+    db_path = os.path.abspath(os.path.expanduser(db_path))
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    saver = AsyncSqliteSaver.from_conn_string(db_path)
+    saver.serde = OrjsonSerializer()
+    return saver
+
+async def delete_thread_checkpoints(checkpointer: Any, thread_id: str):
+    """Removes a thread's checkpoints once its run reached END (they only serve to resume unfinished runs)."""
+    if checkpointer is None:
+        return
+    try:
+        await checkpointer.setup()
+        async with checkpointer.lock:
+            for table in ("checkpoints", "writes"):
+                try:
+                    await checkpointer.conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+                except sqlite3.OperationalError:
+                    # Older savers have no pending-writes table
+                    pass
+            await checkpointer.conn.commit()
+    except Exception as e:
+        logger.warning(f"Failed to delete checkpoints of {thread_id}: {e}")
+
 # [Fix] Correct Step Logic
 def route_step(state: CodingCrewState) -> str:
     """
@@ -51,8 +119,8 @@ def build_coding_crew_graph(rotator: GeminiKeyRotator, memory=None, search=None,
     workflow.add_node("planner", nodes.planner_node)
     workflow.add_node("coder", nodes.coder_node)
     workflow.add_node("executor", nodes.executor_node)
+    # The security audit is a field of the reviewer's structured verdict (one LLM call, no fan-out)
     workflow.add_node("reviewer", nodes.reviewer_node)
-    workflow.add_node("security_guard", nodes.security_node) 
     workflow.add_node("aggregator", nodes.aggregator_node)   
     workflow.add_node("reflector", nodes.reflector_node) 
     workflow.add_node("summarizer", nodes.summarizer_node)
@@ -68,13 +136,8 @@ def build_coding_crew_graph(rotator: GeminiKeyRotator, memory=None, search=None,
     # 2. Loop
     workflow.add_edge("coder", "executor")
     
-    # Parallel Fork
     workflow.add_edge("executor", "reviewer")
-    workflow.add_edge("executor", "security_guard")
-    
-    # Join
     workflow.add_edge("reviewer", "aggregator")
-    workflow.add_edge("security_guard", "aggregator")
     
     # 3. Router logic
     workflow.add_conditional_edges(
@@ -95,6 +158,22 @@ def build_coding_crew_graph(rotator: GeminiKeyRotator, memory=None, search=None,
     
     return workflow.compile(checkpointer=checkpointer)
 
+@functools.lru_cache(maxsize=None)
+def get_default_graph() -> Any:
+    """Builds the default graph and its checkpointer on first use (not at import)."""
+    if not GEMINI_API_KEYS:
+        return None
+    return build_coding_crew_graph(
+        GeminiKeyRotator(GATEWAY_API_BASE, GEMINI_API_KEYS),
+        checkpointer=create_checkpointer()
+    )
+
+def __getattr__(name: str) -> Any:
+    # Default export discovered by CrewRegistry (`graph_module.graph`), built lazily
+    if name == "graph":
+        return get_default_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == "__main__":
     # [Fix] Moved Mock inside main check
     pass
@@ -1,55 +1,727 @@
+import asyncio
+import contextlib
 import logging
 import os
-import json
-from typing import Dict, Any, List
+import re
+import orjson
+import hashlib
+import functools
+import weakref
+from typing import Dict, Any, List, Optional, Tuple
 from langchain_core.messages import HumanMessage, SystemMessage
 
+from config.keys import MODEL_TIERS
 from core.models import GeminiModelConfig
-from core.rotator import GeminiKeyRotator
-from core.sandbox_manager import get_sandbox
+from core.utils import PROMPT_HOT_RELOAD, calculate_cost
+from core.rotator import GeminiKeyRotator, CacheAffinityLost
+from core.sandbox_manager import get_or_create_sandbox, warmup_sandbox
 from core.mcp_tool_definitions import MCPToolDefinitions
+from core.semantic_cache import SemanticCache, LLM_CACHE_DIR, SEMANTIC_CACHE_ENABLED
+from core.repo_map import await_repo_map
+from core.context_slicer import slice_file_context, is_excerpt
 from agents.crews.coding_crew.state import CodingCrewState, ProjectState
 
 logger = logging.getLogger(__name__)
+cost_logger = logging.getLogger("cost")
+
+# [Optimization] Smallest prompt (tokens) Gemini accepts for a context cache, by model family;
+# the longest matching prefix wins. CODER_CACHE_MIN_TOKENS overrides it for other models
+CACHE_MIN_TOKENS_BY_MODEL = {
+    "gemini-1.5": 4096,
+    "gemini-2.0": 4096,
+    "gemini-2.5-flash": 1024,
+    "gemini-2.5-pro": 4096,
+}
+DEFAULT_CACHE_MIN_TOKENS = 4096
+CODER_CACHE_TTL_SECONDS = 300
+
+def _cache_min_tokens(model_name: str) -> int:
+    override = os.getenv("CODER_CACHE_MIN_TOKENS")
+    if override:
+        return int(override)
+    name = model_name.rsplit("/", 1)[-1]
+    matches = [prefix for prefix in CACHE_MIN_TOKENS_BY_MODEL if name.startswith(prefix)]
+    return CACHE_MIN_TOKENS_BY_MODEL[max(matches, key=len)] if matches else DEFAULT_CACHE_MIN_TOKENS
+
+# [Optimization] Functional review and security audit share one structured-output call
+REVIEW_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "status": {"type": "string", "enum": ["approve", "reject"]},
+        "feedback": {"type": "string"},
+        # Filled on reject: the reviewer doubles as reflector, so the retry needs no extra LLM call
+        "root_cause": {"type": "string"},
+        "fix_strategy": {"type": "string"},
+        "security": {
+            "type": "object",
+            "properties": {
+                "score": {"type": "integer"},
+                "safe": {"type": "boolean"},
+                "issues": {"type": "array", "items": {"type": "string"}}
+            }
+        },
+        "robustness": {
+            "type": "object",
+            "properties": {"score": {"type": "integer"}}
+        }
+    },
+    "required": ["status", "feedback"]
+}
+
+# [Optimization] On the last plan step the reviewer also writes the task summary (filled only on
+# approve), so a successful run needs no separate summarizer round-trip
+REVIEW_WITH_SUMMARY_SCHEMA = {
+    **REVIEW_RESPONSE_SCHEMA,
+    "properties": {**REVIEW_RESPONSE_SCHEMA["properties"], "summary": {"type": "string"}},
+}
+REVIEW_SUMMARY_INSTRUCTION = (
+    "This is the final step of the plan. If you approve, also fill \"summary\" with a short summary "
+    "of the whole task outcome for the user (under 100 characters/words, in the user's language)."
+)
+
+def _env_roles(name: str) -> frozenset:
+    return frozenset(r.strip() for r in os.getenv(name, "").split(",") if r.strip())
+
+# Generation roles are non-deterministic: a user who retries expects a new attempt, not the previous
+# reply, so they bypass the response cache unless listed in LLM_CACHE_GENERATION_ROLES (opt-in)
+GENERATION_ROLES = frozenset({"coder", "architect"})
+# Roles whose replies must always be fresh (e.g. "reviewer" if a re-run should re-judge identical output);
+# comma-separated role names in LLM_CACHE_SKIP_ROLES
+UNCACHED_ROLES = _env_roles("LLM_CACHE_SKIP_ROLES") | (GENERATION_ROLES - _env_roles("LLM_CACHE_GENERATION_ROLES"))
+
+# [Optimization] Coder history window: newest messages first until this token budget is spent
+MAX_HISTORY_TOKENS = 8000
+
+# [Optimization] Messages older than the newest HISTORY_KEEP_RECENT are folded into one running summary
+# (simple model, flex tier) once the history exceeds HISTORY_COMPACT_THRESHOLD, instead of being forgotten
+HISTORY_COMPACT_THRESHOLD = 40
+HISTORY_KEEP_RECENT = 20
+
+def _estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars per token, plus per-message framing)."""
+    return (len(text) + 20) // 4
+
+# [Optimization] Per-tool output kept in graph state (tail, where tracebacks end up)
+MAX_CAPTURED_OUTPUT = 8192
+
+def _clip_tail(text: str, limit: int = MAX_CAPTURED_OUTPUT) -> Tuple[str, bool]:
+    """Keeps the last `limit` characters; returns (text, was_truncated)."""
+    if len(text) <= limit:
+        return text, False
+    return text[-limit:], True
+
+# [Security] Data Loss Prevention (DLP): secrets scrubbed from tool output in a single pass
+SENSITIVE_PATTERNS = ["BEGIN RSA PRIVATE KEY", "AWS_ACCESS_KEY_ID", "AIzaSy"]
+_SENSITIVE_RE = re.compile("|".join(re.escape(p) for p in SENSITIVE_PATTERNS))
+DLP_SLACK = max(len(p) for p in SENSITIVE_PATTERNS)
+
+# [Optimization] Execution output budgets for prompts that only need the gist (input tokens = cost + TTFT)
+REVIEW_OUTPUT_CHARS = 6000
+SUMMARY_OUTPUT_CHARS = 2000
+
+# Input cap for the one-off overview of a huge active file (pasted multi-MB files would otherwise go out whole)
+FILE_OVERVIEW_MAX_CHARS = 200_000
+
+def _clip_middle(text: str, limit: int) -> str:
+    """Keeps head and tail (what ran / where it failed) and elides the middle."""
+    if len(text) <= limit:
+        return text
+    half = limit // 2
+    return f"{text[:half]}\n...[{len(text) - 2 * half} chars elided]...\n{text[-half:]}"
+
+def _code_hash(text: str) -> str:
+    """Short content fingerprint used to detect unchanged coder output between iterations."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+# [Optimization] Failures whose verdict is obvious; the reviewer rejects them without an LLM call
+_MISSING_MODULE_RE = re.compile(r"^ModuleNotFoundError: No module named '([\w.]+)'", re.MULTILINE)
+_SYNTAX_ERROR_RE = re.compile(r"^SyntaxError: (.+)$", re.MULTILINE)
+
+# Keyword fallback for unstructured reviews; one case-insensitive scan instead of upper-casing the reply twice
+_VERDICT_RE = re.compile(r"APPROVE|REJECT", re.IGNORECASE)
+
+@functools.lru_cache(maxsize=256)
+def _python_syntax_error(content: str, filepath: str) -> Optional[str]:
+    """
+    [Optimization] In-process syntax gate for generated .py files (no sandbox round-trip).
+    Returns a "SyntaxError: ..." line the reviewer's quick-reject recognizes, or None.
+    Cached by content, so an unchanged file is compiled once.
+    """
+    try:
+        compile(content, filepath, "exec", dont_inherit=True)
+    except SyntaxError as e:
+        return f"SyntaxError: {e.msg} ({filepath}, line {e.lineno})"
+    except ValueError as e:  # e.g. null bytes
+        return f"SyntaxError: {e} ({filepath})"
+    return None
+
+def _syntax_errors(tool_calls: List[Dict[str, Any]]) -> List[str]:
+    """Compiles every .py file the tool calls would write; returns one line per file that fails."""
+    return [
+        error for error in (
+            _python_syntax_error(t["parameters"].get("content") or "", t["parameters"].get("filepath") or "<generated>")
+            for t in tool_calls
+            if t.get("name") == "write_to_file" and str(t.get("parameters", {}).get("filepath", "")).endswith(".py")
+        ) if error
+    ]
+
+# [Optimization] Optional architect annotation, e.g. "Add tests (depends on: 1, 3)" or "(depends on: none)"
+_DEPENDS_ON_RE = re.compile(r"\s*\(depends on:\s*([^)]*)\)\s*$", re.IGNORECASE)
+_STEP_NUMBER_RE = re.compile(r"\d+")
+
+def _parse_step_dependencies(step: str, index: int) -> Tuple[str, List[int]]:
+    """
+    Strips the dependency annotation from a plan step and returns (step, 0-based deps).
+    Steps without an annotation conservatively depend on the previous step.
+    """
+    match = _DEPENDS_ON_RE.search(step)
+    if not match:
+        return step, ([index - 1] if index > 0 else [])
+    deps = [int(n) - 1 for n in _STEP_NUMBER_RE.findall(match.group(1))]
+    return step[:match.start()].rstrip(), [d for d in deps if 0 <= d < index]
+
+def _quick_reject_feedback(execution_output: str) -> Optional[str]:
+    """Returns canned rejection feedback for known trivial failures, or None if a real review is needed."""
+    if execution_output == "No tools executed.":
+        return "No <tool_code> calls were found. Use the tools to apply the change instead of describing it."
+    if "Sandbox environment not found" in execution_output:
+        return "Sandbox unavailable: the step could not be executed or verified."
+    match = _MISSING_MODULE_RE.search(execution_output)
+    if match:
+        module = match.group(1).split(".")[0]
+        return f"Module '{module}' is not installed. Run `pip install {module}` via execute_command or use the standard library."
+    match = _SYNTAX_ERROR_RE.search(execution_output)
+    if match:
+        return f"Fix the syntax error reported by the interpreter: {match.group(1)}"
+    return None
+
+# {name} placeholders in prompt templates; unknown names are left untouched
+# [Optimization] Summaries of small first-try edits are derived locally instead of asking the LLM
+TRIVIAL_SUMMARY_MAX_LINES = 50
+
+def _trivial_summary(state: "CodingCrewState") -> Optional[str]:
+    """
+    Returns a rule-based summary when the outcome is fully described by the state: a single-step
+    plan approved on the first attempt that wrote at most one small file. None means "ask the LLM".
+    """
+    tool_calls = getattr(state, 'tool_calls', None)
+    if tool_calls is None or getattr(state, 'iteration_count', 0) or len(state.plan or []) > 1:
+        return None
+    output = getattr(state, 'execution_output', "") or ""
+    if "Failed:" in output or "Traceback" in output:
+        return None
+
+    writes = [t["parameters"] for t in tool_calls if t.get("name") == "write_to_file"]
+    files = {w.get("filepath") for w in writes}
+    if len(files) > 1:
+        return None
+    lines = sum((w.get("content") or "").count("\n") + 1 for w in writes)
+    if lines > TRIVIAL_SUMMARY_MAX_LINES:
+        return None
+
+    requirement = str(getattr(state, 'user_requirement', "")).strip().splitlines()
+    task = requirement[0][:60] if requirement else "任务"
+    commands = sum(1 for t in tool_calls if t.get("name") == "execute_command")
+    parts = [f"已完成：{task}。"]
+    if files:
+        parts.append(f"修改 {next(iter(files))} (约 {lines} 行)。")
+    if commands:
+        parts.append(f"执行 {commands} 条命令，结果正常。")
+    parts.append("一次通过审查。")
+    return "".join(parts)
+
+_PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+@functools.lru_cache(maxsize=32)
+def _compile_template(template: str) -> Tuple[Tuple[str, Optional[str]], ...]:
+    """Splits a prompt template once into (literal, placeholder) pieces; the last placeholder is None."""
+    pieces, pos = [], 0
+    for m in _PLACEHOLDER_RE.finditer(template):
+        pieces.append((template[pos:m.start()], m.group(1)))
+        pos = m.end()
+    pieces.append((template[pos:], None))
+    return tuple(pieces)
+
+def _render_template(template: str, values: Dict[str, str]) -> str:
+    """
+    [Optimization] Fills {name} placeholders with a single join over the precompiled pieces: no
+    regex scan per render, and braces inside substituted code are never re-interpreted. Unknown
+    placeholders are left as written.
+    """
+    out = []
+    for literal, name in _compile_template(template):
+        out.append(literal)
+        if name is not None:
+            out.append(values.get(name, f"{{{name}}}"))
+    return "".join(out)
+
+PROMPT_ROLES = ("architect", "coder", "reviewer", "planner", "debugger", "reflection", "summarizer")
+PROMPTS_DIR = os.path.join(os.path.dirname(__file__), "prompts")
+
+@functools.lru_cache(maxsize=None)
+def _read_prompt(role: str) -> str:
+    """
+    Reads a prompt template once per process. The default graph shares a single CodingNodes, which
+    loads its templates once anyway; this matters when further instances are built (e.g. per-config graphs).
+    """
+    file_path = os.path.join(PROMPTS_DIR, f"{role}.md")
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        logger.warning(f"Prompt file not found: {file_path}. Using fallback.")
+        return f"You are an expert {role}."
+
+# Only these bytes change the scanner state; everything in between is skipped in C
+_JSON_SPECIAL_RE = re.compile(rb'[{}"\\]')
+_JSON_SPECIAL_STR_RE = re.compile(r'[{}"\\]')
+
+def _scan_json_object(raw: bytes, start: int) -> Optional[Tuple[int, int]]:
+    """
+    Single-pass brace matcher over UTF-8 bytes: returns the (start, end) span of the object
+    opening at `start`. Tracks string literals and escapes so braces inside strings are ignored.
+    O(n), no backtracking; jumps straight between structural characters.
+    """
+    depth = 0
+    in_string = False
+    pos = start
+    while True:
+        match = _JSON_SPECIAL_RE.search(raw, pos)
+        if match is None:
+            return None
+        i = match.start()
+        ch = raw[i]
+        pos = i + 1
+        if in_string:
+            if ch == 0x5C:    # backslash: skip the escaped byte
+                pos += 1
+            elif ch == 0x22:  # closing quote
+                in_string = False
+            continue
+        if ch == 0x22:
+            in_string = True
+        elif ch == 0x7B:
+            depth += 1
+        elif ch == 0x7D:
+            depth -= 1
+            if depth == 0:
+                return start, pos
+
+class _JsonObjectTracker:
+    """
+    Incremental counterpart of _scan_json_object for streamed text: feed chunks, and `complete`
+    flips once the first top-level object has closed. `is_json` is False if the reply opened with
+    anything but "{" (prose), None until the first non-whitespace character arrives.
+    """
+    def __init__(self):
+        self.is_json: Optional[bool] = None
+        self.complete = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str):
+        if self.complete or self.is_json is False:
+            return
+        pos = 0
+        if self.is_json is None:
+            stripped = text.lstrip()
+            if not stripped:
+                return
+            self.is_json = stripped[0] == "{"
+            if not self.is_json:
+                return
+            pos = len(text) - len(stripped)
+        if self._escaped:
+            # Escape sequence split across chunks
+            self._escaped = False
+            pos += 1
+        # Same jump scan as _scan_json_object: only structural characters are visited in Python
+        while True:
+            match = _JSON_SPECIAL_STR_RE.search(text, pos)
+            if match is None:
+                return
+            ch = match.group()
+            pos = match.end()
+            if self._in_string:
+                if ch == "\\":
+                    if pos >= len(text):
+                        self._escaped = True
+                        return
+                    pos += 1
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.complete = True
+                    return
+
+# [Optimization] A prose (non-JSON) review only feeds the keyword fallback; stop paying for it past this
+REVIEW_PROSE_BUDGET = 2000
+
+def _extract_json(text: str) -> Optional[Dict[str, Any]]:
+    """Returns the first top-level JSON object embedded in an LLM response, skipping prose and fences."""
+    # [Optimization] Encode once; candidates are parsed from zero-copy memoryview slices
+    raw = text.encode("utf-8")
+    # Fast path: schema-constrained replies are bare JSON (orjson skips surrounding whitespace itself)
+    try:
+        obj = orjson.loads(raw)
+        if isinstance(obj, dict):
+            return obj
+    except orjson.JSONDecodeError:
+        pass
+    view = memoryview(raw)
+    start = raw.find(b"{")
+    while start != -1:
+        span = _scan_json_object(raw, start)
+        if span is None:
+            return None
+        try:
+            obj = orjson.loads(view[span[0]:span[1]])
+            if isinstance(obj, dict):
+                return obj
+        except orjson.JSONDecodeError:
+            pass
+        start = raw.find(b"{", span[1])
+    return None
+
+# Above this size the scan + parse moves to a worker thread so it cannot stall concurrent nodes
+JSON_OFFLOAD_CHARS = 100_000
+
+async def _extract_json_async(text: str) -> Optional[Dict[str, Any]]:
+    """_extract_json for use inside nodes: small replies parse inline, huge ones off the event loop."""
+    if len(text) <= JSON_OFFLOAD_CHARS:
+        return _extract_json(text)
+    return await asyncio.to_thread(_extract_json, text)
+
+# Every CodingNodes instance, so per-task state can be released from outside the graph (api_server)
+_LIVE_NODES: "weakref.WeakSet[CodingNodes]" = weakref.WeakSet()
+
+async def release_task_state(task_id: str):
+    """Drops per-task memos, prefetched coder calls and context caches of a finished (or failed) task."""
+    for nodes in list(_LIVE_NODES):
+        await nodes.release_task(task_id)
 
 class CodingNodes:
     def __init__(self, config: GeminiModelConfig):
         self.config = config
         self.rotator = GeminiKeyRotator(config.base_url, config.api_keys)
         self.prompts = self._load_prompts()
+        # Stable coder prefix hash -> Gemini cached content name
+        self._cache_ids: Dict[str, str] = {}
+        # Prefix hashes that are not cacheable (below the model minimum, or creation failed):
+        # sent inline from then on, not retried per call
+        self._cache_failures: set = set()
+        # Cache name -> task_ids whose prefix uses it; a cache is deleted only once no task holds it
+        self._cache_holders: Dict[str, set] = {}
+        # Serializes cache lookup/creation: a prefetched coder call and the current step's call share
+        # the task's prefix, so the second must reuse the cache the first created, not replace it
+        self._cache_lock = asyncio.Lock()
+        # task_id -> (repo_map, file slice, rendered prefix, prefix sha256); inputs compared by identity.
+        # Dropped by release_task() when the task ends
+        self._coder_prefixes: Dict[str, Tuple[Optional[str], Optional[str], str, str]] = {}
+        # (task_id, step_index) -> coder reply generated ahead of time for an independent step;
+        # popped when the step starts or by release_task() when the task ends
+        self._prefetched: Dict[Tuple[str, int], asyncio.Task] = {}
+        # [Optimization] Identical prompts (retries, reruns) reuse the previous response; across restarts
+        # only when LLM_CACHE_DIR is set
+        self._llm_cache = SemanticCache(
+            threshold=0.97,
+            persist_dir=LLM_CACHE_DIR,
+            embed_fn=self.rotator.make_embed_fn() if SEMANTIC_CACHE_ENABLED else None
+        )
+        _LIVE_NODES.add(self)
+
+    async def _cached_llm_call(self, role: str, model_name: str, prompt: str, compute) -> Tuple[str, Dict[str, int]]:
+        """
+        Serves (text, usage) for a fully formatted prompt from the response cache, calling
+        `compute()` on a miss. Hits report zero usage flagged as `cached`, since no tokens were billed.
+        """
+        if role in UNCACHED_ROLES:
+            return await compute()
+        fresh = False
+
+        async def _compute():
+            nonlocal fresh
+            fresh = True
+            return await compute()
+
+        text, usage = await self._llm_cache.get_or_compute(f"{role}\n{model_name}\n{prompt}", _compute)
+        return text, (usage if fresh else {"prompt_token_count": 0, "candidates_token_count": 0, "cached": True})
+
+    @staticmethod
+    def _update_cost(project_state: ProjectState, model_name: str, usage: Dict[str, int]):
+        """
+        Accumulates token usage into project_state.cost_stats. Nodes run on one event loop and
+        this does not await, so the update is atomic without a lock.
+        """
+        if not usage:
+            return
+        stats = project_state.cost_stats
+        if usage.get("cached"):
+            stats.cache_hits += 1
+            return
+        input_tokens = usage.get("prompt_token_count", 0)
+        output_tokens = usage.get("candidates_token_count", 0)
+        cost = calculate_cost(model_name, input_tokens, output_tokens)
+
+        stats.total_input_tokens += input_tokens
+        stats.total_output_tokens += output_tokens
+        stats.total_cost += cost
+        stats.request_count += 1
+        if cost_logger.isEnabledFor(logging.DEBUG):
+            cost_logger.debug(f"{model_name}: +{input_tokens}/{output_tokens} tokens, +${cost:.6f}")
+
+    @staticmethod
+    def _flush_cost_summary(project_state: ProjectState):
+        """Logs the task's accumulated cost once, at the end of the run."""
+        stats = project_state.cost_stats
+        cost_logger.info(
+            f"Task {project_state.task_id}: {stats.request_count} requests ({stats.cache_hits} cache hits), "
+            f"{stats.total_input_tokens} in / {stats.total_output_tokens} out tokens, ${stats.total_cost:.4f}"
+        )
 
     def _load_prompts(self) -> Dict[str, str]:
         """Loads prompt templates from the prompts directory."""
-        prompts = {}
-        roles = ["architect", "coder", "reviewer", "planner", "debugger", "reflection", "summarizer"]
-        base_path = os.path.join(os.path.dirname(__file__), "prompts")
-        
-        for role in roles:
-            file_path = os.path.join(base_path, f"{role}.md")
+        if PROMPT_HOT_RELOAD:
+            # Dev mode: pick up edited templates on every new task
+            _read_prompt.cache_clear()
+        return {role: _read_prompt(role) for role in PROMPT_ROLES}
+
+    def _build_coder_prefix(self, project_state: ProjectState) -> str:
+        """
+        Persistent part of the coder prompt: the template rendered with project context that is
+        stable across retries. [Optimization] Rendered (and hashed) once per task; re-rendered
+        only when the repo map or active file slice object is replaced.
+        """
+        fc = project_state.file_context
+        if fc and project_state.file_context_slice is None:
+            project_state.file_context_slice = slice_file_context(fc)
+
+        repo_map, file_slice = project_state.repo_map, project_state.file_context_slice
+        cached = self._coder_prefixes.get(project_state.task_id)
+        if cached and cached[0] is repo_map and cached[1] is file_slice:
+            return cached[2]
+
+        values = {
+            "user_input": project_state.user_input,
+            "file_context": f"({fc.filename})\n{file_slice}" if fc else "(none)",
+            "repo_map": repo_map or "(not available)",
+            # Per-step feedback changes every iteration, so it lives in the uncached tail
+            "feedback": "See the plan step, recent history and rejection notes below.",
+            # Tools are declared natively on the request
+            "mcp_tools": "",
+        }
+        prefix = _render_template(self.prompts["coder"], values)
+        digest = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        self._coder_prefixes[project_state.task_id] = (repo_map, file_slice, prefix, digest)
+        return prefix
+
+    async def _ensure_file_slice(self, project_state: ProjectState):
+        """
+        Computes the active-file view once per task. When the file could not be sliced by structure
+        (non-Python or unparseable) the excerpt is followed by a one-off overview of the whole file
+        from the simple model on the flex tier. The overview is cached by file content,
+        so later tasks on an unchanged file get it for free.
+        """
+        fc = project_state.file_context
+        if fc is None or project_state.file_context_slice is not None:
+            return
+        file_slice = slice_file_context(fc)
+        if is_excerpt(file_slice):
+            overview_prompt = (
+                "Summarize the structure of this file for a developer who can only see part of it: "
+                "its sections, main definitions and what each is for. Under 300 words.\n\n"
+                f"File: {fc.filename}\n{_clip_middle(fc.content, FILE_OVERVIEW_MAX_CHARS)}"
+            )
+            contents = [{"role": "user", "parts": [{"text": overview_prompt}]}]
+            try:
+                overview, usage = await self._cached_llm_call(
+                    "file_overview", MODEL_TIERS["simple"], overview_prompt,
+                    lambda: self.rotator.call_gemini_with_rotation(
+                        model_name=self.config.model_name,
+                        contents=contents,
+                        complexity="simple",
+                        service_tier="flex"
+                    )
+                )
+                self._update_cost(project_state, MODEL_TIERS["simple"], usage)
+                file_slice = f"{file_slice}\n\n[FILE OVERVIEW]\n{overview}"
+            except Exception as e:
+                logger.warning(f"File overview failed, using the excerpt alone: {e}")
+        project_state.file_context_slice = file_slice
+
+    def _prefix_digest(self, project_state: ProjectState, prefix: str) -> str:
+        cached = self._coder_prefixes.get(project_state.task_id)
+        if cached and cached[2] is prefix:
+            return cached[3]
+        return hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+
+    async def _ensure_coder_cache(self, project_state: ProjectState, prefix: str) -> Optional[str]:
+        """
+        Returns a context cache name for the stable coder prefix, creating it on first use.
+        Prefixes below the model's cache minimum are not cacheable and fall back to inline prompts.
+        """
+        min_tokens = _cache_min_tokens(self.config.model_name)
+        # Every token spans at least one character: shorter prefixes can't qualify, skip the count
+        if len(prefix) < min_tokens:
+            return None
+
+        key = self._prefix_digest(project_state, prefix)
+        if key in self._cache_failures:
+            return None
+        task_id = project_state.task_id
+        async with self._cache_lock:
+            if key in self._cache_failures:
+                return None
+            cache_name = self._cache_ids.get(key)
+            if cache_name is not None and not self.rotator.is_cache_alive(cache_name):
+                # About to expire: extend in place; if it already expired server-side, referencing it
+                # would fail the request, so drop it and recreate
+                if not await self.rotator.extend_context_cache(cache_name, CODER_CACHE_TTL_SECONDS):
+                    self._cache_ids.pop(key, None)
+                    self._cache_holders.pop(cache_name, None)
+                    cache_name = None
+            if cache_name is None:
+                contents = [{"role": "user", "parts": [{"text": prefix}]}]
+                tools = MCPToolDefinitions.get_coding_tools()
+                try:
+                    tokens = await self.rotator.count_tokens(self.config.model_name, contents, tools)
+                except Exception as e:
+                    logger.warning(f"Token count failed, estimating: {e}")
+                    tokens = _estimate_tokens(prefix)
+                if tokens < min_tokens:
+                    self._cache_failures.add(key)
+                    return None
+                try:
+                    cache_name = await self.rotator.create_context_cache(
+                        model_name=self.config.model_name,
+                        contents=contents,
+                        tools=tools,
+                        ttl_seconds=CODER_CACHE_TTL_SECONDS
+                    )
+                except Exception as e:
+                    logger.warning(f"Context cache creation failed, sending full prompt: {e}")
+                    self._cache_failures.add(key)
+                    return None
+                self._cache_ids[key] = cache_name
+            self._cache_holders.setdefault(cache_name, set()).add(task_id)
+
+            # Repo map / active file changed: this task no longer needs its previous prefix cache
+            previous = project_state.artifacts.get("coder_cache_id")
+            if previous and previous != cache_name:
+                await self._release_cache(previous, task_id)
+
+            project_state.artifacts["coder_cache_id"] = cache_name
+            return cache_name
+
+    async def _release_cache(self, cache_name: str, task_id: str):
+        """Drops task_id's hold on a context cache; the last holder deletes it server-side."""
+        holders = self._cache_holders.get(cache_name)
+        if holders is not None:
+            holders.discard(task_id)
+            if holders:
+                # Another task with the same prefix is still using it
+                return
+            del self._cache_holders[cache_name]
+        self._cache_ids = {k: v for k, v in self._cache_ids.items() if v != cache_name}
+        await self.rotator.delete_context_cache(cache_name)
+
+    async def _stream_coder_response(
+        self, project_state: ProjectState, contents: List[Dict[str, Any]], cache_name: Optional[str]
+    ) -> Tuple[str, Dict[str, int]]:
+        """
+        Streams the coder reply. As soon as a <tool_code> block starts, the task's sandbox is
+        warmed up in a worker thread so Docker startup overlaps with the rest of the generation.
+        """
+        chunks: List[str] = []
+        usage: Dict[str, int] = {}
+        warmup_task = None
+        tail = ""
+
+        async for text, chunk_usage in self.rotator.call_gemini_with_rotation_stream(
+            model_name=self.config.model_name,
+            contents=contents,
+            tools=MCPToolDefinitions.get_coding_tools(),
+            cached_content_name=cache_name
+        ):
+            chunks.append(text)
+            usage = chunk_usage or usage
+            if warmup_task is None:
+                # The marker may be split across chunks, so check the joined boundary
+                if "<tool_code>" in tail + text:
+                    warmup_task = asyncio.create_task(asyncio.to_thread(
+                        warmup_sandbox, project_state.task_id, project_state.workspace_root
+                    ))
+                tail = text[-len("<tool_code>"):]
+
+        if warmup_task is not None:
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    prompts[role] = f.read()
-            except FileNotFoundError:
-                logger.warning(f"Prompt file not found: {file_path}. Using fallback.")
-                prompts[role] = f"You are an expert {role}."
-        return prompts
+                await warmup_task
+            except Exception as e:
+                logger.warning(f"Sandbox warm-up failed: {e}")
+
+        return "".join(chunks), usage
+
+    async def _stream_review_response(
+        self, contents: List[Dict[str, Any]], generation_config: Dict[str, Any]
+    ) -> Tuple[str, Dict[str, int]]:
+        """
+        Streams the reviewer verdict and closes the stream early: as soon as the JSON object is
+        complete (trailing output is never used), or once a prose reply exceeds REVIEW_PROSE_BUDGET.
+        """
+        chunks: List[str] = []
+        usage: Dict[str, int] = {}
+        received = 0
+        tracker = _JsonObjectTracker()
+        stream = self.rotator.call_gemini_with_rotation_stream(
+            model_name=self.config.model_name,
+            contents=contents,
+            generation_config=generation_config,
+            service_tier="flex"
+        )
+        # aclosing: leaving the loop early closes the HTTP stream and releases the request slot
+        async with contextlib.aclosing(stream):
+            async for text, chunk_usage in stream:
+                chunks.append(text)
+                usage = chunk_usage or usage
+                received += len(text)
+                tracker.feed(text)
+                if tracker.complete:
+                    break
+                if tracker.is_json is False and received > REVIEW_PROSE_BUDGET:
+                    logger.warning("Reviewer replied with prose instead of JSON; truncating the stream.")
+                    break
+        return "".join(chunks), usage
 
     async def architect_node(self, state: CodingCrewState) -> Dict[str, Any]:
         """
         Architect analyzes the requirement and outputs a high-level plan.
         """
         logger.info("🏗️ Architect Node Running...")
-        prompt_content = self.prompts["architect"]
-        user_req = state.user_requirement
+        # Placeholders are filled by _render_template; the JSON example braces in the template stay literal
+        prompt_content = _render_template(self.prompts["architect"], {
+            "user_input": str(state.user_requirement),
+            "repo_map": state.project_state.repo_map or "(not available)",
+        })
         
         contents = [
-            {"role": "user", "parts": [{"text": f"{prompt_content}\n\nRequirement: {user_req}"}]}
+            {"role": "user", "parts": [{"text": prompt_content}]}
         ]
         
-        response_text, usage = await self.rotator.call_gemini_with_rotation(
-            model_name=self.config.model_name,
-            contents=contents
+        response_text, usage = await self._cached_llm_call(
+            "architect", self.config.model_name, contents[0]["parts"][0]["text"],
+            lambda: self.rotator.call_gemini_with_rotation(
+                model_name=self.config.model_name,
+                contents=contents
+            )
         )
+        self._update_cost(state.project_state, self.config.model_name, usage)
         
         # Robust Plan Parsing
         # Assumes LLM outputs a list starting with "-" or numbered list
@@ -66,54 +738,219 @@ class CodingNodes:
             logger.warning("Architect produced no structured plan. Using generic plan.")
             plan_steps = ["Analyze Codebase", "Implement Solution", "Verify Implementation"]
 
+        step_dependencies = []
+        for i, step in enumerate(plan_steps):
+            plan_steps[i], deps = _parse_step_dependencies(step, i)
+            step_dependencies.append(deps)
+
         return {
             "plan": plan_steps,
+            "step_dependencies": step_dependencies,
             "messages": [HumanMessage(content=response_text)]
         }
 
-    async def coder_node(self, state: CodingCrewState) -> Dict[str, Any]:
-        """
-        Coder generates code for the current step using available tools.
-        """
-        logger.info("👨‍💻 Coder Node Running...")
-        
-        # Get current step
-        if state.current_step_index < len(state.plan):
-            current_step = state.plan[state.current_step_index]
+    def _build_coder_context(self, state: CodingCrewState, step_index: int) -> str:
+        """Per-step tail of the coder prompt: the plan step plus recent messages within a token budget."""
+        if step_index < len(state.plan):
+            current_step = state.plan[step_index]
         else:
             current_step = "Final Review and Cleanup"
 
-        prompt_content = self.prompts["coder"]
-        
-        # Build Context
-        history_str = ""
-        if state.messages:
-            # Include last few messages for context
-            last_msgs = state.messages[-3:] 
-            for msg in last_msgs:
-                history_str += f"{msg.type}: {msg.content}\n"
+        # Build Context: newest messages first until the token budget is spent.
+        # System messages (standing instructions) are always kept and are charged first.
+        messages = state.messages or []
+        pinned = [f"{m.type}: {m.content}\n" for m in messages if m.type == "system"]
+        # Older turns live on as a summary (see _compact_history); only newer ones are scanned
+        covered, summary = state.project_state.artifacts.get("history_summary", (0, ""))
+        if summary:
+            pinned.append(f"summary of earlier turns: {summary}\n")
+            messages = messages[covered:]
+        budget = MAX_HISTORY_TOKENS - sum(_estimate_tokens(line) for line in pinned)
+        history_lines: List[str] = []
+        for msg in reversed(messages):
+            if msg.type == "system":
+                continue
+            line = f"{msg.type}: {msg.content}\n"
+            cost = _estimate_tokens(line)
+            if cost > budget:
+                if not history_lines and budget > 0:
+                    # Always keep the tail of the latest message (where feedback/tracebacks end up)
+                    history_lines.append(f"{msg.type}: ...{msg.content[-budget * 4:]}\n")
+                break
+            history_lines.append(line)
+            budget -= cost
+        history_str = "".join(pinned + history_lines[::-1])
 
-        context_msg = f"""
+        # [Optimization] Retry: diagnosis and the rewrite happen in this one call (no separate reflector LLM hop)
+        fix_instruction = ""
+        if step_index == state.current_step_index and getattr(state, 'reflection', ""):
+            fix_instruction = f"""
+        Previous Attempt Rejected (attempt {state.iteration_count}):
+        {state.reflection}
+        First state in one or two sentences why it failed and your fix strategy, then emit the corrected <tool_code> calls.
+        """
+
+        return f"""
         Current Plan Step: {current_step}
         
         Recent History:
         {history_str}
+        {fix_instruction}"""
+
+    async def _compact_history(self, state: CodingCrewState):
+        """
+        Folds messages that are about to age out of the coder window into a running summary
+        (artifacts["history_summary"] = (messages covered, text)), so early goals and decisions
+        survive long sessions. Runs once per HISTORY_KEEP_RECENT new messages, not every call.
         """
+        messages = state.messages or []
+        artifacts = state.project_state.artifacts
+        covered, summary = artifacts.get("history_summary", (0, ""))
+        if len(messages) <= HISTORY_COMPACT_THRESHOLD or len(messages) - covered <= HISTORY_COMPACT_THRESHOLD:
+            return
+
+        upto = len(messages) - HISTORY_KEEP_RECENT
+        transcript = "".join(f"{m.type}: {m.content}\n" for m in messages[covered:upto] if m.type != "system")
+        compact_prompt = (
+            "Produce a compact factual summary of this coding session transcript. Preserve the goal, "
+            "decisions made, file names and identifiers, and open problems. Under 300 words.\n\n"
+            + (f"Summary so far:\n{summary}\n\n" if summary else "")
+            + f"New transcript:\n{transcript}"
+        )
+        contents = [{"role": "user", "parts": [{"text": compact_prompt}]}]
+        try:
+            text, usage = await self._cached_llm_call(
+                "history_summary", MODEL_TIERS["simple"], compact_prompt,
+                lambda: self.rotator.call_gemini_with_rotation(
+                    model_name=self.config.model_name,
+                    contents=contents,
+                    complexity="simple",
+                    service_tier="flex"
+                )
+            )
+        except Exception as e:
+            logger.warning(f"History compaction failed, keeping the plain window: {e}")
+            return
+        self._update_cost(state.project_state, MODEL_TIERS["simple"], usage)
+        artifacts["history_summary"] = (upto, text.strip())
+
+    async def _generate_code(self, project_state: ProjectState, context_msg: str) -> Tuple[str, Dict[str, int]]:
+        """Runs the coder model for one step, using the context cache for the stable prefix when possible."""
+        prefix = self._build_coder_prefix(project_state)
+        return await self._cached_llm_call(
+            "coder", self.config.model_name, f"{prefix}\n\n{context_msg}",
+            lambda: self._call_coder(project_state, prefix, context_msg)
+        )
+
+    async def _call_coder(self, project_state: ProjectState, prefix: str, context_msg: str) -> Tuple[str, Dict[str, int]]:
+        # [Optimization] Stable prefix goes into a context cache; only the step tail is resent
+        cache_name = await self._ensure_coder_cache(project_state, prefix)
         
-        contents = [
-            {"role": "user", "parts": [{"text": f"{prompt_content}\n\n{context_msg}"}]}
-        ]
+        if cache_name:
+            contents = [{"role": "user", "parts": [{"text": context_msg}]}]
+        else:
+            contents = [{"role": "user", "parts": [{"text": f"{prefix}\n\n{context_msg}"}]}]
         
-        # Call Gemini with Tools Definition
-        response_text, usage = await self.rotator.call_gemini_with_rotation(
-            model_name=self.config.model_name,
-            contents=contents,
-            tools=MCPToolDefinitions.get_coding_tools(),
-            cached_content_name=state.project_state.cache_name 
-        )
+        # Call Gemini with Tools Definition (streamed, see _stream_coder_response)
+        try:
+            return await self._stream_coder_response(project_state, contents, cache_name)
+        except CacheAffinityLost as e:
+            # Owner key of the cache is exhausted: forget the cache and resend the full prompt
+            logger.warning(f"{e}. Retrying without context cache.")
+            self._cache_ids = {k: v for k, v in self._cache_ids.items() if v != cache_name}
+            self._cache_holders.pop(cache_name, None)
+            project_state.artifacts.pop("coder_cache_id", None)
+            return await self._stream_coder_response(
+                project_state,
+                [{"role": "user", "parts": [{"text": f"{prefix}\n\n{context_msg}"}]}],
+                None
+            )
+
+    def _prefetch_next_step(self, state: CodingCrewState):
+        """
+        [Optimization] Plan-level pipelining: if the next step does not depend on the current one,
+        start its coder call now so it overlaps with execution and review of the current step.
+        Only the first attempt of a step prefetches; retries would just re-issue the same call.
+        """
+        if getattr(state, 'iteration_count', 0):
+            return
+        plan = state.plan or []
+        next_index = state.current_step_index + 1
+        dependencies = getattr(state, 'step_dependencies', None) or []
+        if next_index >= len(plan) or next_index >= len(dependencies):
+            return
+        if state.current_step_index in dependencies[next_index]:
+            return
+
+        project_state = state.project_state
+        key = (project_state.task_id, next_index)
+        if key in self._prefetched:
+            return
+        logger.info(f"Prefetching coder output for independent step {next_index + 1}.")
+        context_msg = self._build_coder_context(state, next_index)
+
+        async def _prefetch() -> Tuple[str, Dict[str, int]]:
+            result = await self._generate_code(project_state, context_msg)
+            # Billed whether or not the step ever consumes it
+            self._update_cost(project_state, self.config.model_name, result[1])
+            return result
+
+        self._prefetched[key] = asyncio.create_task(_prefetch())
+
+    async def _take_prefetched(self, task_id: str, step_index: int) -> Optional[Tuple[str, Dict[str, int]]]:
+        """
+        Returns a prefetched coder reply for this step, or None if there is none (or it failed).
+        Its cost was already recorded when it finished.
+        """
+        for key in [k for k in self._prefetched if k[0] == task_id and k[1] < step_index]:
+            self._prefetched.pop(key).cancel()
+        prefetch = self._prefetched.pop((task_id, step_index), None)
+        if prefetch is None:
+            return None
+        try:
+            return await prefetch
+        except Exception as e:
+            logger.warning(f"Prefetched coder call failed, regenerating: {e}")
+            return None
+
+    async def release_task(self, task_id: str):
+        """
+        Cancels the task's outstanding prefetched coder calls, drops its per-task memos and
+        releases its context caches.
+        """
+        for key in [k for k in self._prefetched if k[0] == task_id]:
+            self._prefetched.pop(key).cancel()
+        self._coder_prefixes.pop(task_id, None)
+        async with self._cache_lock:
+            for cache_name in [name for name, holders in self._cache_holders.items() if task_id in holders]:
+                await self._release_cache(cache_name, task_id)
+
+    async def coder_node(self, state: CodingCrewState) -> Dict[str, Any]:
+        """
+        Coder generates code for the current step using available tools.
+        """
+        logger.info("👨‍💻 Coder Node Running...")
+        
+        # First attempt at a step may already have been generated while the previous step ran
+        # Repo map was scheduled in the background at task start; only block on it here
+        if not state.project_state.repo_map:
+            state.project_state.repo_map = await await_repo_map(state.project_state.task_id)
+        await self._ensure_file_slice(state.project_state)
+        await self._compact_history(state)
+        
+        result = None
+        if not getattr(state, 'iteration_count', 0):
+            result = await self._take_prefetched(state.project_state.task_id, state.current_step_index)
+        if result is None:
+            context_msg = self._build_coder_context(state, state.current_step_index)
+            result = await self._generate_code(state.project_state, context_msg)
+            self._update_cost(state.project_state, self.config.model_name, result[1])
+        response_text, usage = result
         
         return {
             "messages": [HumanMessage(content=response_text)],
+            "generated_code_hash": _code_hash(response_text),
+            "tool_calls": MCPToolDefinitions.parse_tool_calls(response_text),
             "usage_metadata": usage
         }
 
@@ -127,77 +964,134 @@ class CodingNodes:
         logger.info("📦 Executor Node Running...")
         
         last_message = state.messages[-1]
-        # Parse XML tool calls
-        tool_calls = MCPToolDefinitions.parse_tool_calls(last_message.content)
+        artifacts = state.project_state.artifacts
+        
+        # [Optimization] Byte-identical coder output: reuse the previous run instead of re-executing
+        code_hash = getattr(state, 'generated_code_hash', None) or _code_hash(last_message.content)
+        if code_hash == artifacts.get("last_executed_hash") and "last_execution_result" in artifacts:
+            logger.info("Executor: coder output unchanged since last run, reusing previous result.")
+            return dict(artifacts["last_execution_result"])
+        
+        self._prefetch_next_step(state)
+        
+        # XML tool calls were parsed once by coder_node; parse here only for states that predate that
+        tool_calls = getattr(state, 'tool_calls', None)
+        if tool_calls is None:
+            tool_calls = MCPToolDefinitions.parse_tool_calls(last_message.content)
+        
+        # Retrieve the task's long-lived sandbox (created on first use, reused across iterations).
+        # [Optimization] Started first so container startup overlaps the syntax gate below
+        sandbox_task = asyncio.create_task(asyncio.to_thread(
+            get_or_create_sandbox, state.project_state.task_id, state.project_state.workspace_root
+        ))
         
-        # Retrieve the correct sandbox for this task
-        sandbox = get_sandbox(state.project_state.task_id)
+        # Syntax errors in generated Python are caught here: nothing is written, no container exec.
+        # compile() of large files runs in a thread so it doesn't stall other tasks on the loop
+        syntax_errors = await asyncio.to_thread(_syntax_errors, tool_calls)
+        if syntax_errors:
+            logger.info("Executor: generated code does not compile, skipping sandbox execution.")
+            # The sandbox stays registered for the next attempt; just retrieve any startup error
+            sandbox_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            result = {"execution_output": "\n".join(syntax_errors), "execution_output_truncated": False}
+            artifacts["last_executed_hash"] = code_hash
+            artifacts["last_execution_result"] = result
+            return result
+        
+        try:
+            sandbox = await sandbox_task
+        except Exception as e:
+            logger.error(f"Sandbox startup failed: {e}")
+            sandbox = None
         if not sandbox:
             return {"execution_output": "Error: CRITICAL - Sandbox environment not found for this task."}
 
-        results = []
-        for tool in tool_calls:
-            try:
-                name = tool["name"]
-                params = tool["parameters"]
-                
-                output = ""
+        # [Optimization] Consecutive read_file calls have no side effects: run each such group concurrently.
+        # Everything else keeps program order (writes and commands depend on what came before).
+        outcomes: List[Tuple[str, bool]] = []
+        reads: List[Dict[str, Any]] = []
+        for tool in tool_calls + [None]:
+            if tool is not None and tool.get("name") == "read_file":
+                reads.append(tool)
+                continue
+            if reads:
+                outcomes.extend(await asyncio.gather(*(self._run_tool(sandbox, r) for r in reads)))
+                reads = []
+            if tool is not None:
+                outcomes.append(await self._run_tool(sandbox, tool))
+
+        results = [text for text, _ in outcomes]
+        truncated = any(clipped for _, clipped in outcomes)
+
+        execution_summary = "\n---\n".join(results)
+        
+        result = {
+            "execution_output": execution_summary if execution_summary else "No tools executed.",
+            "execution_output_truncated": truncated
+        }
+        artifacts["last_executed_hash"] = code_hash
+        artifacts["last_execution_result"] = result
+        return result
+
+    async def _run_tool(self, sandbox, tool: Dict[str, Any]) -> Tuple[str, bool]:
+        """Runs one parsed tool call; returns (formatted result, was_truncated)."""
+        name = tool.get("name", "?")
+        try:
+            params = tool["parameters"]
+            
+            output = ""
+            
+            if name == "execute_command":
+                cmd = params.get("command")
+                # Use execute_shell for shell commands
+                # [Optimization] Docker exec blocks; run it off the event loop
+                stdout, stderr = await asyncio.to_thread(sandbox.execute_shell, cmd)
+                # Only the tail survives _clip_tail below: trim each stream first (with slack so a
+                # secret marker at the cut is still scrubbed) instead of joining and scanning it all
+                keep = MAX_CAPTURED_OUTPUT + DLP_SLACK
+                output = f"Stdout: {stdout[-keep:]}\nStderr: {stderr[-keep:]}"
                 
-                if name == "execute_command":
-                    cmd = params.get("command")
-                    # Use execute_shell for shell commands
-                    stdout, stderr = sandbox.execute_shell(cmd)
-                    output = f"Stdout: {stdout}\nStderr: {stderr}"
-                    
-                elif name == "write_to_file":
-                    fpath = params.get("filepath")
-                    content = params.get("content")
-                    # Write file inside container using python helper
-                    # Escaping triple quotes for safety
-                    safe_content = content.replace("'''", "\\'\\'\\'")
-                    code = f"""
+            elif name == "write_to_file":
+                fpath = params.get("filepath")
+                content = params.get("content")
+                # Write file inside container using python helper
+                # [Fix] Embed path and content as Python literals (repr): content containing
+                # triple quotes or a trailing backslash no longer breaks the helper script
+                code = f"""
 import os
-os.makedirs(os.path.dirname('{fpath}'), exist_ok=True)
-with open('{fpath}', 'w', encoding='utf-8') as f:
-    f.write(r'''{content}''')
+os.makedirs(os.path.dirname({fpath!r}) or '.', exist_ok=True)
+with open({fpath!r}, 'w', encoding='utf-8') as f:
+    f.write({content!r})
 print('File written successfully')
 """
-                    stdout, stderr, _ = sandbox.execute_code(code)
-                    output = f"Write Result: {stdout} {stderr}"
+                stdout, stderr, _ = await asyncio.to_thread(sandbox.execute_code, code)
+                output = f"Write Result: {stdout} {stderr}"
 
-                elif name == "read_file":
-                    fpath = params.get("filepath")
-                    code = f"""
+            elif name == "read_file":
+                fpath = params.get("filepath")
+                code = f"""
 try:
-    with open('{fpath}', 'r', encoding='utf-8') as f:
+    with open({fpath!r}, 'r', encoding='utf-8') as f:
         print(f.read())
 except Exception as e:
     print(f'Error reading file: {{e}}')
 """
-                    stdout, stderr, _ = sandbox.execute_code(code)
-                    output = stdout if stdout.strip() else stderr
+                stdout, stderr, _ = await asyncio.to_thread(sandbox.execute_code, code)
+                output = stdout if stdout.strip() else stderr
 
-                else:
-                    output = f"Unknown tool: {name}"
+            else:
+                output = f"Unknown tool: {name}"
 
-                # [Security] Data Loss Prevention (DLP)
-                # Scrub secrets before returning to LLM or Logs
-                SENSITIVE_PATTERNS = ["BEGIN RSA PRIVATE KEY", "AWS_ACCESS_KEY_ID", "AIzaSy"]
-                for pattern in SENSITIVE_PATTERNS:
-                    if pattern in output:
-                        output = output.replace(pattern, "[REDACTED_SECRET]")
+            # [Security] Data Loss Prevention (DLP)
+            # Scrub secrets before returning to LLM or Logs
+            output = _SENSITIVE_RE.sub("[REDACTED_SECRET]", output)
 
-                results.append(f"Tool '{name}':\n{output}")
-                
-            except Exception as e:
-                logger.error(f"Tool execution error: {e}")
-                results.append(f"Tool '{name}' Failed: {str(e)}")
+            # Bound state size at capture time (state is checkpointed every step)
+            output, clipped = _clip_tail(output)
+            return f"Tool '{name}':\n{output}", clipped
 
-        execution_summary = "\n---\n".join(results)
-        
-        return {
-            "execution_output": execution_summary if execution_summary else "No tools executed."
-        }
+        except Exception as e:
+            logger.error(f"Tool execution error: {e}")
+            return f"Tool '{name}' Failed: {str(e)}", False
 
     async def reviewer_node(self, state: CodingCrewState) -> Dict[str, Any]:
         """
@@ -207,22 +1101,147 @@ except Exception as e:
         prompt = self.prompts["reviewer"]
         
         last_exec = state.execution_output if hasattr(state, 'execution_output') else "No execution output."
+        if getattr(state, 'execution_output_truncated', False):
+            last_exec = f"[Tool output truncated to the last {MAX_CAPTURED_OUTPUT} chars]\n{last_exec}"
         last_plan = state.plan[state.current_step_index] if state.plan else "Unknown Step"
         
+        quick_feedback = _quick_reject_feedback(last_exec)
+        # [Optimization] Coder resubmitted byte-identical output for a step it was rejected on:
+        # the verdict cannot change, so skip the review and tell the coder it changed nothing
+        artifacts = state.project_state.artifacts
+        code_hash = getattr(state, 'generated_code_hash', None)
+        previous = artifacts.get("last_rejected_review")
+        if (not quick_feedback and code_hash and previous
+                and previous.get("hash") == code_hash and previous.get("step") == state.current_step_index):
+            quick_feedback = (
+                "The code is unchanged from the previously rejected attempt. "
+                f"Address this feedback before resubmitting:\n{previous.get('feedback', '')}"
+            )
+        if quick_feedback:
+            logger.info("Reviewer short-circuit: known failure pattern, skipping LLM call.")
+            return {
+                "messages": [HumanMessage(content=quick_feedback)],
+                "approved": False,
+                "review_report": {"status": "reject", "feedback": quick_feedback},
+                "review_status": "reject",
+                "review_feedback": quick_feedback
+            }
+        
+        code = next(
+            (m.content for m in reversed(state.messages or []) if "<tool_code>" in m.content),
+            "(none)"
+        )
+        review_prompt = _render_template(prompt, {
+            "user_input": str(getattr(state, 'user_requirement', "")),
+            "code": _clip_middle(code, REVIEW_OUTPUT_CHARS),
+            "stdout": _clip_middle(last_exec, REVIEW_OUTPUT_CHARS),
+            "stderr": "(merged into Stdout)",
+        })
+        review_prompt = f"{review_prompt}\n\nTask Step: {last_plan}"
+        is_last_step = not state.plan or state.current_step_index + 1 >= len(state.plan)
+        if is_last_step:
+            review_prompt = f"{review_prompt}\n\n{REVIEW_SUMMARY_INSTRUCTION}"
         contents = [{
             "role": "user", 
-            "parts": [{"text": f"{prompt}\n\nTask Step: {last_plan}\n\nExecution Result:\n{last_exec}"}]
+            "parts": [{"text": review_prompt}]
         }]
         
-        response_text, _ = await self.rotator.call_gemini_with_rotation(
-            model_name=self.config.model_name,
-            contents=contents
-        )
+        generation_config = {
+            "response_mime_type": "application/json",
+            "response_schema": REVIEW_WITH_SUMMARY_SCHEMA if is_last_step else REVIEW_RESPONSE_SCHEMA
+        }
+        compute = lambda: self._stream_review_response(contents, generation_config)
+        response_text, usage = await self._cached_llm_call("reviewer", self.config.model_name, review_prompt, compute)
+        self._update_cost(state.project_state, self.config.model_name, usage)
+        
+        # Check approval: prefer the structured verdict, fall back to keyword matching
+        report = await _extract_json_async(response_text)
+        if report and "status" in report:
+            is_approved = str(report["status"]).strip().lower() == "approve"
+        else:
+            report = {}
+            verdicts = {v.upper() for v in _VERDICT_RE.findall(response_text)}
+            is_approved = "APPROVE" in verdicts and "REJECT" not in verdicts
         
-        # Check approval
-        is_approved = "APPROVE" in response_text.upper() and "REJECT" not in response_text.upper()
+        if is_approved:
+            artifacts.pop("last_rejected_review", None)
+        elif code_hash:
+            artifacts["last_rejected_review"] = {
+                "hash": code_hash, "step": state.current_step_index, "feedback": report.get("feedback", "")
+            }
         
         return {
             "messages": [HumanMessage(content=response_text)],
-            "approved": is_approved
+            "approved": is_approved,
+            "review_report": report,
+            # Aggregated verdict keys read by route_step; the security audit is part of this same call
+            "review_status": "approve" if is_approved else "reject",
+            "review_feedback": report.get("feedback", "")
+        }
+
+    async def reflector_node(self, state: CodingCrewState) -> Dict[str, Any]:
+        """
+        Records the rejection for the next coder attempt. The coder folds diagnosis and
+        the corrected code into a single call, so no LLM request is made here.
+        """
+        logger.info("🔁 Reflector Node Running...")
+        report = getattr(state, 'review_report', None) or {}
+        feedback = report.get("feedback") or getattr(state, 'review_feedback', "") or ""
+        if not feedback and state.messages:
+            feedback = state.messages[-1].content
+        # Diagnosis produced by the same reviewer call (see REVIEW_RESPONSE_SCHEMA)
+        if report.get("root_cause"):
+            feedback += f"\nRoot cause: {report['root_cause']}"
+        if report.get("fix_strategy"):
+            feedback += f"\nFix strategy: {report['fix_strategy']}"
+        feedback, _ = _clip_tail(feedback, MAX_HISTORY_TOKENS)
+        return {
+            "iteration_count": getattr(state, 'iteration_count', 0) + 1,
+            "reflection": feedback
+        }
+
+    async def summarizer_node(self, state: CodingCrewState) -> Dict[str, Any]:
+        """
+        Summarizes the task outcome.
+        """
+        logger.info("📝 Summarizer Node Running...")
+        # Last node of every run (success, max retries): nothing ahead of it can use a prefetch
+        await self.release_task(state.project_state.task_id)
+        trivial = _trivial_summary(state)
+        if trivial is not None:
+            logger.info("Summarizer short-circuit: small first-try edit, skipping LLM call.")
+            self._flush_cost_summary(state.project_state)
+            return {"final_output": trivial}
+
+        report = getattr(state, 'review_report', None) or {}
+        if getattr(state, 'review_status', None) == "approve" and report.get("summary"):
+            logger.info("Summarizer short-circuit: using the summary from the final review.")
+            self._flush_cost_summary(state.project_state)
+            return {"final_output": report["summary"]}
+
+        code = next(
+            (m.content for m in reversed(state.messages or []) if "<tool_code>" in m.content),
+            ""
+        )
+        summary_prompt = _render_template(self.prompts["summarizer"], {
+            "user_input": str(getattr(state, 'user_requirement', "")),
+            "code": code,
+            "execution_output": _clip_middle(getattr(state, 'execution_output', "") or "", SUMMARY_OUTPUT_CHARS),
+        })
+        contents = [{"role": "user", "parts": [{"text": summary_prompt}]}]
+
+        response_text, usage = await self._cached_llm_call(
+            "summarizer", MODEL_TIERS["simple"], summary_prompt,
+            lambda: self.rotator.call_gemini_with_rotation(
+                model_name=self.config.model_name,
+                contents=contents,
+                complexity="simple",
+                service_tier="flex"
+            )
+        )
+        self._update_cost(state.project_state, MODEL_TIERS["simple"], usage)
+        self._flush_cost_summary(state.project_state)
+        return {
+            "final_output": response_text,
+            "usage_metadata": usage
         }
@@ -1,18 +1,28 @@
-from typing import List, Dict, Any, Optional, TypedDict
+from typing import Annotated, List, Dict, Any, TypedDict
+from langchain_core.messages import BaseMessage
+from langgraph.graph.message import add_messages
 from core.models import ProjectState
 
 # [Optimization] 明确定义 TypedDict 以支持并行键
 class CodingCrewState(TypedDict, total=False):
     project_state: ProjectState
+    user_requirement: str
     iteration_count: int
+    # 各节点只返回新增的消息，由 add_messages 追加到历史 (coder 的历史窗口读取此键)
+    messages: Annotated[List[BaseMessage], add_messages]
     
     # [Phase 1 Upgrade] Planner-Actor Architecture
     plan: List[str]          # 步骤清单，例如 ["Create file", "Implement logic", "Test"]
     current_step_index: int  # 当前执行到第几步 (0-based)
+    step_dependencies: List[List[int]]  # 每一步依赖的步骤下标；无依赖的下一步可提前生成代码
     
     generated_code: str
+    generated_code_hash: str  # coder 输出指纹，内容未变时 executor 复用上次结果
+    tool_calls: List[Dict[str, Any]]  # coder 输出中解析出的工具调用 (只解析一次，executor 直接使用)
     
     # Executor outputs
+    execution_output: str
+    execution_output_truncated: bool  # 工具输出在采集时已截断 (仅保留尾部)
     execution_stdout: str
     execution_stderr: str
     execution_passed: bool
@@ -28,6 +38,8 @@ class CodingCrewState(TypedDict, total=False):
     review_status: str
     review_feedback: str
     review_report: Dict[str, Any]
+    approved: bool
     
     reflection: str
     final_output: str
+    usage_metadata: Dict[str, Any]  # 最近一次 LLM 调用的 token 用量
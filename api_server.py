@@ -2,23 +2,31 @@ import os
 import uuid
 import uvicorn
 import asyncio
+import atexit
+import concurrent.futures
 import logging
-import psutil
+import logging.handlers
+import queue
 import signal
-import json
+import sys
+import orjson
+from collections import deque
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request, BackgroundTasks, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 
 # 假设这些模块都在项目中存在
 from config.keys import GEMINI_API_KEYS
 from core.models import GeminiModelConfig
-from core.sandbox_manager import cleanup_all_sandboxes
+from core.sandbox_manager import cleanup_all_sandboxes, release_sandbox, warmup_sandbox
+from tools.sandbox import pull_base_image
+from core.repo_map import discard_repo_map, schedule_repo_map
 # 引入 Graph 创建函数
-from agents.crews.coding_crew.graph import create_coding_crew
+from agents.crews.coding_crew.graph import create_coding_crew, delete_thread_checkpoints
+from agents.crews.coding_crew.nodes import release_task_state
 from agents.crews.coding_crew.state import CodingCrewState, ProjectState
 
 # [Security] Configure Logging
@@ -28,6 +36,36 @@ logging.basicConfig(
     level=getattr(logging, LOG_LEVEL),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
+# [Optimization] While the server runs, handlers (stdout is a pipe to the extension host) run on
+# a listener thread; nodes on the event loop only enqueue records and never block on terminal I/O.
+# Installed by the server lifespan, not at import, so importers keep their own logging setup.
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+def start_log_listener():
+    global _log_listener
+    if _log_listener is not None:
+        return
+    log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(log_queue, *logging.root.handlers, respect_handler_level=True)
+    logging.root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    _log_listener.start()
+
+def stop_log_listener():
+    """Flushes queued records and puts the original handlers back."""
+    global _log_listener
+    if _log_listener is None:
+        return
+    listener, _log_listener = _log_listener, None
+    listener.stop()
+    logging.root.handlers = list(listener.handlers)
+
+atexit.register(stop_log_listener)
+
+def _hard_exit(code: int = 0):
+    # os._exit skips atexit: flush the log queue first so the final records are not lost
+    stop_log_listener()
+    os._exit(code)
+
 logger = logging.getLogger("api_server")
 
 # Silence noisy libraries
@@ -43,21 +81,39 @@ TRUSTED_WORKSPACE_ROOT = os.environ.get("VSCODE_WORKSPACE_ROOT")
 # Limit max concurrent Docker containers to prevent DoS
 MAX_CONCURRENT_TASKS = 5
 task_semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
+# Worker threads for blocking calls (sandbox exec, DNS, disk cache) across all tasks
+BLOCKING_IO_THREADS = int(os.environ.get("BLOCKING_IO_THREADS", 8 * MAX_CONCURRENT_TASKS))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    start_log_listener()
     logger.info(f"🚀 API Server starting. Parent PID: {HOST_PID}")
     
+    # [Optimization] asyncio.to_thread shares the loop's default executor (min(32, cpus + 4) threads).
+    # Docker execs hold a thread for a whole command, so on small machines a few parallel tasks
+    # would queue DNS checks, cache disk I/O and syntax gates behind them; size it explicitly
+    asyncio.get_running_loop().set_default_executor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=BLOCKING_IO_THREADS, thread_name_prefix="blocking-io")
+    )
+
     # Start suicide pact monitoring in background
-    if HOST_PID > 0:
+    if HOST_PID > 0 and not arm_parent_death_signal():
         asyncio.create_task(monitor_parent_process())
+
+    # [Optimization] Pull the sandbox image up front so the first task doesn't pay for it
+    prewarm = asyncio.create_task(asyncio.to_thread(pull_base_image))
+    prewarm.add_done_callback(
+        lambda t: t.cancelled() or t.exception() is None or logger.warning(f"Sandbox image prewarm failed: {t.exception()}")
+    )
     
     yield
     
     # Shutdown
     logger.info("🛑 API Server shutting down. Cleaning up resources...")
-    cleanup_all_sandboxes()
+    # Stopping containers blocks for seconds; in-flight SSE streams still get their final frames
+    await asyncio.to_thread(cleanup_all_sandboxes)
+    stop_log_listener()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -91,6 +147,41 @@ async def verify_token(request: Request, call_next):
     response = await call_next(request)
     return response
 
+# [Optimization] Linux: the kernel signals us when the parent dies, so no polling loop is needed.
+# SIGUSR1 rather than SIGTERM: uvicorn's SIGTERM handler waits for open SSE streams to finish.
+PARENT_DEATH_SIGNAL = signal.SIGUSR1 if hasattr(signal, "SIGUSR1") else None
+PR_SET_PDEATHSIG = 1
+
+def arm_parent_death_signal() -> bool:
+    """
+    Asks the kernel to send PARENT_DEATH_SIGNAL when HOST_PID (our direct parent) exits.
+    Returns False when unsupported (non-Linux, or VS Code is not the direct parent);
+    the caller then falls back to polling.
+    """
+    if PARENT_DEATH_SIGNAL is None or not sys.platform.startswith("linux") or os.getppid() != HOST_PID:
+        return False
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.prctl(PR_SET_PDEATHSIG, int(PARENT_DEATH_SIGNAL), 0, 0, 0) != 0:
+            return False
+        asyncio.get_running_loop().add_signal_handler(PARENT_DEATH_SIGNAL, _on_parent_death)
+    except (OSError, AttributeError, NotImplementedError, RuntimeError) as e:
+        logger.warning(f"Parent death signal unavailable, polling instead: {e}")
+        return False
+    # The parent may have exited before prctl took effect
+    if os.getppid() != HOST_PID:
+        _on_parent_death()
+    logger.info(f"🛡️ Suicide Pact Active: kernel notifies on exit of Parent PID {HOST_PID}")
+    return True
+
+def _on_parent_death():
+    logger.critical(f"💀 Parent process {HOST_PID} died. executing cleanup protocol...")
+    try:
+        cleanup_all_sandboxes()
+    finally:
+        _hard_exit(0)
+
 async def monitor_parent_process():
     """
     [Safety] Suicide Pact:
@@ -101,17 +192,19 @@ async def monitor_parent_process():
         logger.warning("⚠️ No HOST_PID provided. Suicide pact disabled.")
         return
 
+    # Only the polling fallback needs psutil
+    import psutil
     logger.info(f"🛡️ Suicide Pact Active: Monitoring Parent PID {HOST_PID}")
     while True:
         try:
             if not psutil.pid_exists(HOST_PID):
                 logger.critical(f"💀 Parent process {HOST_PID} died. executing cleanup protocol...")
                 cleanup_all_sandboxes() # [Fix] Explicit cleanup call
-                os._exit(0) # Force exit
+                _hard_exit(0) # Force exit
         except Exception as e:
             logger.error(f"Error in suicide pact: {e}")
             cleanup_all_sandboxes()
-            os._exit(0)
+            _hard_exit(0)
         await asyncio.sleep(2)
 
 # --- Models ---
@@ -188,26 +281,60 @@ async def run_workflow_with_semaphore(task_id, inputs, config, workspace_root):
         task_semaphore.release()
         logger.debug(f"Task {task_id} finished, semaphore released.")
 
-# Global storage for event queues (for SSE)
-task_event_queues: Dict[str, asyncio.Queue] = {}
+# Global storage for event streams (for SSE)
+# [Optimization] deque + Event instead of asyncio.Queue: producers append and set, the consumer
+# drains everything buffered per wake-up (single event loop, so no lock is needed)
+task_event_streams: Dict[str, Tuple[deque, asyncio.Event]] = {}
+
+# [Optimization] Constant events are pushed as these shared dicts and written as pre-encoded frames
+_COMPLETE_EVENT = {"type": "complete", "status": "success"}
+_CLOSE_EVENT = {"type": "close"}
+# [Optimization] Frames are the shared prefix + orjson bytes + terminator (no formatting per event)
+_FRAME_PREFIX = b"data: "
+_FRAME_END = b"\n\n"
+
+def _sse_frame(msg: Dict) -> bytes:
+    return _FRAME_PREFIX + orjson.dumps(msg, default=str) + _FRAME_END
+
+_CONSTANT_FRAMES = {id(event): _sse_frame(event) for event in (_COMPLETE_EVENT, _CLOSE_EVENT)}
+# Idle streams get an SSE comment line this often (seconds)
+SSE_PING_INTERVAL = 15
+# Events pushed within this window (seconds) of the first one go out in a single write
+SSE_COALESCE_SECONDS = 0.01
+# [Fix] A finished task's buffered events are dropped after this long even if no client ever
+# subscribed (the SSE generator only removes streams it has consumed)
+SSE_STREAM_RETENTION = 300
+_PING_FRAME = b": ping\n\n"
 
 async def run_workflow_background(task_id: str, inputs: Dict, config: GeminiModelConfig, workspace_root: str):
     logger.info(f"▶️ Background Workflow Started: {task_id}")
     
-    # Create Event Queue
-    queue = asyncio.Queue()
-    task_event_queues[task_id] = queue
+    # Create Event Stream
+    events, ready = deque(), asyncio.Event()
+    task_event_streams[task_id] = (events, ready)
 
     # Helper to push updates
+    # [Optimization] Events stay dicts until the SSE writer serializes them once with orjson
     async def push_update(data: Dict):
-        await queue.put(json.dumps(data))
+        events.append(data)
+        ready.set()
 
+    sandbox_warmup = None
     try:
         # Initialize Graph
         app_graph = create_coding_crew(config)
         
         # Initialize State
-        project_state = ProjectState.init_from_task(task_id, workspace_root)
+        project_state = ProjectState.init_from_task(
+            inputs.get("user_requirement", ""), task_id, workspace_root=workspace_root
+        )
+        # [Optimization] Workspace scan runs in the background while the architect plans
+        schedule_repo_map(task_id, workspace_root)
+        # ...and the sandbox (warm pool hit or fresh container) comes up alongside them
+        sandbox_warmup = asyncio.create_task(asyncio.to_thread(warmup_sandbox, task_id, workspace_root))
+        sandbox_warmup.add_done_callback(
+            lambda t: t.cancelled() or t.exception() is None or logger.warning(f"Sandbox warm-up failed: {t.exception()}")
+        )
         
         initial_state = CodingCrewState(
             **inputs,
@@ -218,8 +345,20 @@ async def run_workflow_background(task_id: str, inputs: Dict, config: GeminiMode
             messages=[]
         )
 
-        # Run Graph
-        async for output in app_graph.astream(initial_state):
+        # Run Graph. With a checkpointer (COMPILE_CHECKPOINT_DB), a request that reuses the task_id
+        # of an unfinished run (server crashed mid-run) resumes at the last node boundary:
+        # LangGraph continues from the saved state when the input is None.
+        run_config = {"configurable": {"thread_id": task_id}}
+        graph_input = initial_state
+        if getattr(app_graph, "checkpointer", None) is not None:
+            snapshot = await app_graph.aget_state(run_config)
+            if snapshot and snapshot.next:
+                logger.info(f"Resuming task {task_id} at {snapshot.next}")
+                graph_input = None
+        # [Optimization] Last tool output sent: the executor replays its previous result for an
+        # unchanged retry, and the client already has that log
+        last_log = None
+        async for output in app_graph.astream(graph_input, config=run_config):
             for key, value in output.items():
                 # Notify frontend about node updates
                 await push_update({
@@ -229,49 +368,94 @@ async def run_workflow_background(task_id: str, inputs: Dict, config: GeminiMode
                 })
                 
                 # Check for tool outputs and stream logs if available
-                if key == "executor_node" and "execution_output" in value:
-                     await push_update({
-                         "type": "log",
-                         "content": value["execution_output"]
-                     })
-
-        await push_update({"type": "complete", "status": "success"})
+                # ([Fix] the graph registers the node as "executor")
+                if key in ("executor", "executor_node") and value and "execution_output" in value:
+                    log = value["execution_output"]
+                    if log != last_log:
+                        last_log = log
+                        await push_update({
+                            "type": "log",
+                            "content": log
+                        })
+
+        # Reached END: there is nothing left to resume
+        await delete_thread_checkpoints(getattr(app_graph, "checkpointer", None), task_id)
+        await push_update(_COMPLETE_EVENT)
 
     except Exception as e:
         logger.error(f"❌ Workflow Error: {e}", exc_info=True)
         await push_update({"type": "error", "message": str(e)})
     finally:
-        await push_update({"type": "close"})
+        # Close the stream first: nothing below awaits before the drop is scheduled, so a
+        # cancelled run still cleans up its buffer
+        await push_update(_CLOSE_EVENT)
+        asyncio.get_running_loop().call_later(SSE_STREAM_RETENTION, _drop_event_stream, task_id, events)
+        # Failed or cancelled runs never reach the summarizer: drop a repo map the coder never
+        # picked up, prefetched coder calls and the task's context caches
+        discard_repo_map(task_id)
+        try:
+            await release_task_state(task_id)
+        except Exception as e:
+            logger.warning(f"Releasing task state failed for {task_id}: {e}")
+        # Park the container for the next task on this workspace instead of destroying it
+        try:
+            if sandbox_warmup is not None:
+                # A worker thread can't be cancelled: let a still-running warm-up register its
+                # container first, or it would be orphaned after the release below
+                await asyncio.wait({sandbox_warmup})
+            await asyncio.to_thread(release_sandbox, task_id)
+        except Exception as e:
+            logger.warning(f"Sandbox release failed for {task_id}: {e}")
+
+def _drop_event_stream(task_id: str, events: deque):
+    # Only remove the stream this run created
+    stream = task_event_streams.get(task_id)
+    if stream is not None and stream[0] is events:
+        del task_event_streams[task_id]
 
 @app.get("/api/stream/{task_id}")
-async def stream_task_events(task_id: str, request: Request):
+async def stream_task_events(task_id: str):
     """
     SSE Endpoint for real-time updates.
     """
-    if task_id not in task_event_queues:
+    if task_id not in task_event_streams:
         return JSONResponse(status_code=404, content={"detail": "Task not found"})
 
     async def event_generator():
-        queue = task_event_queues[task_id]
+        events, ready = task_event_streams[task_id]
         try:
+            # No per-event is_disconnected() polling: StreamingResponse listens on the ASGI receive
+            # channel and cancels this generator when the client goes away
             while True:
-                if await request.is_disconnected():
-                    break
-                    
-                data = await queue.get()
-                if data:
-                    yield f"data: {data}\n\n"
-                    
-                    msg = json.loads(data)
-                    if msg.get("type") == "close":
-                        break
+                try:
+                    await asyncio.wait_for(ready.wait(), SSE_PING_INTERVAL)
+                except asyncio.TimeoutError:
+                    # Keep-alive comment so proxies don't drop an idle stream
+                    yield _PING_FRAME
+                    continue
+                # [Optimization] Let the rest of a node's burst arrive, then write it as one chunk:
+                # one socket send per burst, same per-event frames for the client
+                await asyncio.sleep(SSE_COALESCE_SECONDS)
+                ready.clear()
+                frames = []
+                closed = False
+                while events and not closed:
+                    msg = events.popleft()
+                    frames.append(_CONSTANT_FRAMES.get(id(msg)) or _sse_frame(msg))
+                    closed = msg is _CLOSE_EVENT
+                if frames:
+                    yield b"".join(frames)
+                if closed:
+                    return
         except asyncio.CancelledError:
             pass
         finally:
-            task_event_queues.pop(task_id, None)
+            task_event_streams.pop(task_id, None)
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="127.0.0.1", port=port)
+    # loop/http stay "auto": uvicorn[standard] installs uvloop (not on Windows) and httptools, and
+    # auto picks them when present. Access logs are off: one record per request, nobody reads them
+    uvicorn.run(app, host="127.0.0.1", port=port, loop="auto", http="auto", access_log=False)
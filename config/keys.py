@@ -38,4 +38,11 @@ TIER_2_PRO = "gemini-1.5-pro"
 # 默认使用 Flash 以平衡速度和成本，或者从环境变量读取
 GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", TIER_1_FAST)
 
-__all__ = ["GEMINI_API_KEYS", "GATEWAY_API_BASE", "GEMINI_MODEL_NAME", "PINECONE_API_KEY", "PINECONE_ENVIRONMENT", "VECTOR_INDEX_NAME"]
+# [Optimization] 按任务复杂度路由模型：总结等简单任务走更小更快的模型
+TIER_0_LITE = "gemini-1.5-flash-8b"
+MODEL_TIERS = {
+    "simple": os.getenv("GEMINI_SIMPLE_MODEL_NAME", TIER_0_LITE),
+    "complex": GEMINI_MODEL_NAME,
+}
+
+__all__ = ["GEMINI_API_KEYS", "GATEWAY_API_BASE", "GEMINI_MODEL_NAME", "MODEL_TIERS", "PINECONE_API_KEY", "PINECONE_ENVIRONMENT", "VECTOR_INDEX_NAME"]
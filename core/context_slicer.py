@@ -0,0 +1,113 @@
+import ast
+import logging
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from core.api_models import FileContext
+
+logger = logging.getLogger("ContextSlicer")
+
+# [Optimization] 当前文件进入 Prompt 的上限；超过时只保留光标附近的定义 + 其余部分的签名索引
+MAX_FILE_CONTEXT_CHARS = 12000
+CURSOR_WINDOW_LINES = 80
+# 摘录窗口对齐到整行时最多舍弃的字符数
+LINE_ALIGN_SLACK = 400
+
+def slice_file_context(fc: "FileContext") -> str:
+    """
+    生成当前文件的紧凑视图 (每个 ProjectState 计算一次)。
+    Python 文件按 AST 结构切片；解析失败或其他语言时退化为头 + 尾截取。
+    """
+    content = fc.content or ""
+    if len(content) <= MAX_FILE_CONTEXT_CHARS:
+        return content
+
+    if fc.language_id == "python" or fc.filename.endswith(".py"):
+        sliced = _slice_python(content, fc.cursor_line)
+        if sliced is not None and len(sliced) <= MAX_FILE_CONTEXT_CHARS:
+            return sliced
+
+    return _excerpt(content, fc.cursor_line)
+
+# 无法按结构切片时的原文摘录标记；调用方据此补充整个文件的概要 (见 is_excerpt)
+EXCERPT_HEADER = "# [Excerpt]"
+
+def is_excerpt(sliced: str) -> bool:
+    """切片结果是否只是原文片段 (其余部分没有任何索引)。"""
+    return sliced.startswith(EXCERPT_HEADER)
+
+def _excerpt(content: str, cursor_line: Optional[int]) -> str:
+    """有光标时保留光标所在的连续窗口；否则保留头 + 尾。"""
+    if not cursor_line:
+        half = MAX_FILE_CONTEXT_CHARS // 2
+        return (
+            f"{EXCERPT_HEADER} head and tail\n{content[:half]}\n\n"
+            f"# ... [{len(content) - 2 * half} chars omitted] ...\n\n{content[-half:]}"
+        )
+    # 光标行的字符偏移，窗口以它为中心 (靠近文件首尾时向另一侧延伸)
+    offset = 0
+    for _ in range(cursor_line - 1):
+        nl = content.find("\n", offset)
+        if nl == -1:
+            break
+        offset = nl + 1
+    start = max(0, min(offset - MAX_FILE_CONTEXT_CHARS // 2, len(content) - MAX_FILE_CONTEXT_CHARS))
+    # 对齐到整行：只在附近有换行且不越过光标时对齐；超长行 (压缩/生成文件) 中直接截断
+    if start:
+        nl = content.find("\n", start, min(start + LINE_ALIGN_SLACK, offset))
+        if nl != -1:
+            start = nl + 1
+    end = start + MAX_FILE_CONTEXT_CHARS
+    if end < len(content):
+        nl = content.rfind("\n", max(start, end - LINE_ALIGN_SLACK, offset), end)
+        if nl != -1:
+            end = nl + 1
+    first_line = content.count("\n", 0, start) + 1
+    return f"{EXCERPT_HEADER} lines from L{first_line} around the cursor (L{cursor_line})\n{content[start:end]}"
+
+def _slice_python(content: str, cursor_line: Optional[int]) -> Optional[str]:
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError) as e:
+        logger.debug(f"AST slicing unavailable, falling back to head/tail: {e}")
+        return None
+
+    lines = content.splitlines()
+    cursor = cursor_line or 1
+    window = (cursor - CURSOR_WINDOW_LINES, cursor + CURSOR_WINDOW_LINES)
+
+    kept: List[str] = []
+    index: List[str] = []
+    docstring = ast.get_docstring(tree)
+    if docstring:
+        kept.append(f'"""{docstring}"""')
+    _collect(tree.body, lines, window, kept, index)
+
+    if index:
+        kept.append("# Other definitions in this file (bodies omitted):\n" + "\n".join(index))
+    return "\n\n".join(kept)
+
+def _collect(body: List[ast.stmt], lines: List[str], window: Tuple[int, int], kept: List[str], index: List[str]):
+    """保留与光标窗口相交的语句；过大的类只展开其成员，其余定义只记录签名。"""
+    for i, node in enumerate(body):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            continue
+        if i == 0 and isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant):
+            continue  # docstring 已单独保留 (类的 docstring 随类头省略)
+
+        # 装饰器属于定义本身
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+        end = getattr(node, "end_lineno", None) or node.lineno
+        is_def = isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+
+        if end < window[0] or start > window[1]:
+            if is_def:
+                index.append(f"#   L{node.lineno}: {lines[node.lineno - 1].strip()}")
+            continue
+
+        if isinstance(node, ast.ClassDef) and end - start > window[1] - window[0]:
+            kept.append(f"# L{start}\n" + "\n".join(lines[start - 1:node.body[0].lineno - 1]).rstrip())
+            _collect(node.body, lines, window, kept, index)
+            continue
+
+        kept.append(f"# L{start}-{end}\n" + "\n".join(lines[start - 1:end]))
@@ -1,5 +1,26 @@
-from typing import List, Dict, Any
-import re
+import functools
+from typing import List, Dict, Any, Tuple
+
+def _scan_param_tags(block: str) -> List[Tuple[str, str]]:
+    r"""
+    [Optimization] Single forward scan for <key>value</key> pairs inside a parameters block
+    (same matches as the former `<(\w+)>(.*?)</\1>` DOTALL regex, without backtracking).
+    """
+    pairs = []
+    pos = block.find("<")
+    while pos != -1:
+        name_end = block.find(">", pos + 1)
+        if name_end == -1:
+            break
+        name = block[pos + 1:name_end]
+        if name and name.replace("_", "a").isalnum():
+            close_idx = block.find(f"</{name}>", name_end + 1)
+            if close_idx != -1:
+                pairs.append((name, block[name_end + 1:close_idx]))
+                pos = block.find("<", close_idx + len(name) + 3)
+                continue
+        pos = block.find("<", pos + 1)
+    return pairs
 
 class MCPToolDefinitions:
     """
@@ -8,7 +29,9 @@ class MCPToolDefinitions:
     """
 
     @staticmethod
+    @functools.lru_cache(maxsize=1)
     def get_coding_tools() -> List[Dict[str, Any]]:
+        # [Optimization] Static per process: built once; the returned list is shared, don't mutate it
         return [
             {
                 "name": "write_to_file",
@@ -54,23 +77,31 @@ class MCPToolDefinitions:
         Robustly handles multiple tool calls.
         """
         tool_calls = []
+        open_tag, close_tag = "<tool_code>", "</tool_code>"
         
-        # Split by the tool_code tag
-        snippets = llm_output.split("<tool_code>")
-        for snippet in snippets[1:]:
-            end_idx = snippet.find("</tool_code>")
-            if end_idx == -1: continue
+        # [Optimization] Single forward scan with str.find instead of split() copying every snippet
+        start = llm_output.find(open_tag)
+        while start != -1:
+            content_start = start + len(open_tag)
+            next_start = llm_output.find(open_tag, content_start)
             
-            block = snippet[:end_idx]
+            # A block is only valid if it closes before the next opening tag
+            search_end = next_start if next_start != -1 else len(llm_output)
+            end_idx = llm_output.find(close_tag, content_start, search_end)
+            if end_idx == -1:
+                start = next_start
+                continue
+            
+            block = llm_output[content_start:end_idx]
+            start = next_start
             
             name = MCPToolDefinitions._extract_tag_content(block, "name")
             params_block = MCPToolDefinitions._extract_tag_content(block, "parameters")
             
             parameters = {}
             if params_block:
-                # Use Regex to extract all parameter tags
-                # Matches <key>value</key> patterns inside parameters block
-                param_matches = re.findall(r'<(\w+)>(.*?)</\1>', params_block, re.DOTALL)
+                # Extract all <key>value</key> parameter tags inside the parameters block
+                param_matches = _scan_param_tags(params_block)
                 for p_name, p_val in param_matches:
                     parameters[p_name] = p_val.strip()
 
@@ -79,7 +110,7 @@ class MCPToolDefinitions:
                     "name": name,
                     "parameters": parameters
                 })
-                
+            
         return tool_calls
 
     @staticmethod
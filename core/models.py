@@ -7,11 +7,14 @@ class CostStats(BaseModel):
     total_input_tokens: int = 0
     total_output_tokens: int = 0
     request_count: int = 0
+    cache_hits: int = 0  # 命中响应缓存、未产生费用的调用次数
 
 class ProjectState(BaseModel):
     task_id: str
     user_input: str
     file_context: Optional[FileContext] = None
+    # [Optimization] 紧凑版当前文件 (core.context_slicer)，首次使用时计算并复用
+    file_context_slice: Optional[str] = None
     repo_map: Optional[str] = None
     workspace_root: Optional[str] = None
     
@@ -28,6 +31,12 @@ class ProjectState(BaseModel):
     class Config:
         arbitrary_types_allowed = True
 
+    def __setattr__(self, name: str, value: Any) -> None:
+        # 替换当前文件时作废缓存的切片视图，下次使用时按新内容重新计算
+        if name == "file_context":
+            super().__setattr__("file_context_slice", None)
+        super().__setattr__(name, value)
+
     @classmethod
     def init_from_task(cls, user_input: str, task_id: str, file_context: Optional[FileContext] = None, workspace_root: str = None) -> "ProjectState":
         return cls(
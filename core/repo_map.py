@@ -1,6 +1,9 @@
 import os
+import orjson
+import asyncio
+import hashlib
 import logging
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 # 尝试导入 tree-sitter，如果环境不支持则提供优雅降级
 try:
@@ -11,6 +14,15 @@ except ImportError:
 
 logger = logging.getLogger("RepoMapper")
 
+# [Performance] 磁盘缓存目录：工作区未变化时跳过 AST 解析
+REPO_MAP_CACHE_DIR = os.getenv("REPO_MAP_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "coding_crew"))
+
+# [Optimization] 后台生成中的地图: task_id -> asyncio.Task (与 LLM 调用重叠执行)
+_pending_maps: Dict[str, "asyncio.Task[str]"] = {}
+
+# 排除目录
+EXCLUDE_DIRS = {'.git', 'node_modules', '__pycache__', 'dist', 'build', '.vscode', 'venv', 'env'}
+
 class RepositoryMapper:
     """
     [Aider Soul] 代码库地图生成器
@@ -42,35 +54,123 @@ class RepositoryMapper:
         if not self.root_path or not os.path.exists(self.root_path):
             return "[RepoMap] Workspace root not found."
 
+        # [Performance] 增量更新：按文件 (mtime_ns, size) 复用上次的骨架，只重新解析变化的文件
+        cache_path = self._cache_path(max_files)
+        previous = self._load_cached_map(cache_path)
+        prev_files = {
+            path: (mtime, size, skeleton)
+            for path, mtime, size, skeleton in zip(
+                previous.get("paths", []), previous.get("mtimes", []), previous.get("sizes", []), previous.get("skeletons", [])
+            )
+        }
+        # SoA: 并行列表，序列化/加载时只有四个扁平数组
+        paths: List[str] = []
+        mtimes: List[int] = []
+        sizes: List[int] = []
+        skeletons: List[Optional[str]] = []
         repo_map = []
-        file_count = 0
-        
-        # 排除目录
-        exclude_dirs = {'.git', 'node_modules', '__pycache__', 'dist', 'build', '.vscode', 'venv', 'env'}
+        reparsed = 0
 
-        for root, dirs, files in os.walk(self.root_path):
-            # 过滤目录
-            dirs[:] = [d for d in dirs if d not in exclude_dirs]
-            
-            for file in files:
-                if file_count >= max_files:
-                    break
-                
-                ext = os.path.splitext(file)[1]
-                if ext not in self.lang_map:
-                    continue
-                
-                full_path = os.path.join(root, file)
-                rel_path = os.path.relpath(full_path, self.root_path)
-                
+        for rel_path, full_path, ext, st in self._iter_source_files():
+            if len(repo_map) >= max_files:
+                # 名额已满，剩余目录无需再遍历
+                break
+            entry = prev_files.get(rel_path)
+            if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                file_skeleton = entry[2]
+            else:
                 # 解析单个文件
                 file_skeleton = self._parse_file(full_path, rel_path, self.lang_map[ext])
-                if file_skeleton:
-                    repo_map.append(file_skeleton)
-                    file_count += 1
-        
+                reparsed += 1
+            paths.append(rel_path)
+            mtimes.append(st.st_mtime_ns)
+            sizes.append(st.st_size)
+            skeletons.append(file_skeleton)
+            if file_skeleton:
+                repo_map.append((rel_path, file_skeleton))
+
+        # 文件集合与签名都未变化时直接复用上次的结果
+        if reparsed == 0 and paths == previous.get("paths") and previous.get("map"):
+            return previous["map"]
+
         header = f"### 🗺️ Repository Map (Aider-style AST Summary)\n(Current Directory: {self.root_path})\n\n"
-        return header + "\n\n".join(repo_map)
+        result = header + self._render_entries(repo_map)
+        logger.debug(f"Repo map rebuilt: {reparsed} of {len(paths)} files re-parsed")
+        self._save_cached_map(cache_path, {
+            "paths": paths, "mtimes": mtimes, "sizes": sizes, "skeletons": skeletons, "map": result
+        })
+        return result
+
+    def _iter_source_files(self, directory: Optional[str] = None):
+        """
+        按名称排序深度优先遍历 (与原 os.walk 顺序一致)，产出 (rel_path, full_path, ext, stat)。
+        os.scandir 的 DirEntry 自带类型信息，省去逐个 isdir 判断；生成器可在名额满时提前停止。
+        """
+        directory = directory or self.root_path
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            return
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in EXCLUDE_DIRS:
+                        subdirs.append(entry.path)
+                    continue
+                ext = os.path.splitext(entry.name)[1]
+                if ext not in self.lang_map or not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            yield os.path.relpath(entry.path, self.root_path), entry.path, ext, st
+        for subdir in subdirs:
+            yield from self._iter_source_files(subdir)
+
+    @staticmethod
+    def _render_entries(entries: List[Tuple[str, str]]) -> str:
+        """
+        [Optimization] 按目录分组输出：目录路径只出现一次，文件条目只写文件名，
+        减少地图中重复的路径前缀 (每轮迭代都会随 Prompt 重发)。
+        """
+        blocks = []
+        current_dir = None
+        for rel_path, skeleton in entries:
+            directory, filename = os.path.split(rel_path)
+            if directory != current_dir:
+                current_dir = directory
+                blocks.append(f"[{directory or '.'}/]")
+            # 骨架首行是 "rel_path:"，目录已由分组标题给出
+            if skeleton.startswith(rel_path):
+                skeleton = filename + skeleton[len(rel_path):]
+            blocks.append(skeleton)
+        return "\n\n".join(blocks)
+
+    def _cache_path(self, max_files: int) -> str:
+        # v3: 排序遍历 + 按目录分组的地图格式 + SoA 缓存布局
+        key = hashlib.blake2b(f"v3:{os.path.abspath(self.root_path)}:{max_files}".encode("utf-8")).hexdigest()[:16]
+        return os.path.join(REPO_MAP_CACHE_DIR, f"repomap_{key}.json")
+
+    def _load_cached_map(self, cache_path: str) -> dict:
+        """读取上次的地图及逐文件骨架 (paths / mtimes / sizes / skeletons 并行列表)；缺失或损坏时返回空字典"""
+        try:
+            with open(cache_path, 'rb') as f:
+                data = orjson.loads(f.read())
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) and isinstance(data.get("paths"), list) else {}
+
+    def _save_cached_map(self, cache_path: str, data: dict):
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(data))
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Failed to write repo map cache: {e}")
 
     def _parse_file(self, file_path: str, rel_path: str, lang_name: str) -> Optional[str]:
         """解析文件生成骨架"""
@@ -146,3 +246,27 @@ class RepositoryMapper:
             # [Fix] Catch all to prevent crashing the whole map generation
             logger.warning(f"Failed to parse {rel_path}: {e}")
             return None
+
+def schedule_repo_map(task_id: str, root_path: Optional[str]) -> None:
+    """在后台线程中开始生成地图，需在事件循环内调用。"""
+    if not root_path or task_id in _pending_maps:
+        return
+    mapper = RepositoryMapper(root_path)
+    _pending_maps[task_id] = asyncio.create_task(asyncio.to_thread(mapper.generate_map))
+
+async def await_repo_map(task_id: str) -> Optional[str]:
+    """取回后台生成的地图；未调度或生成失败时返回 None。"""
+    pending = _pending_maps.pop(task_id, None)
+    if pending is None:
+        return None
+    try:
+        return await pending
+    except Exception as e:
+        logger.warning(f"Background repo map failed for {task_id}: {e}")
+        return None
+
+def discard_repo_map(task_id: str) -> None:
+    """任务结束时丢弃未被取走的地图 (架构师失败或任务取消时 coder 从未运行)。"""
+    pending = _pending_maps.pop(task_id, None)
+    if pending is not None:
+        pending.cancel()
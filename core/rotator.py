@@ -1,11 +1,44 @@
+import os
+import re
+import time
 import asyncio
+import datetime
 import logging
+import contextlib
+import itertools
 import google.generativeai as genai
-from typing import List, Dict, Any, Tuple
+from google.ai import generativelanguage as glm
+from google.api_core import client_options as client_options_lib
+from typing import List, Dict, Any, Tuple, Optional, AsyncIterator, Callable
 from google.api_core import exceptions
+from config.keys import MODEL_TIERS
 
 logger = logging.getLogger(__name__)
 
+# [Optimization] Upper bound on in-flight requests per key, so fan-out nodes stay under RPM limits
+MAX_CONCURRENT_PER_KEY = int(os.getenv("GEMINI_MAX_CONCURRENT_PER_KEY", "4"))
+
+# [Optimization] Background ("flex") calls may use at most this share of the request slots,
+# so the user-facing coder never queues behind reviewer/summarizer traffic
+FLEX_SLOT_SHARE = 0.5
+
+# CachedContent only accepts explicitly versioned models ("gemini-1.5-flash-001", not "-latest")
+DEFAULT_CACHE_MODEL_VERSION = "001"
+_MODEL_VERSION_RE = re.compile(r"-\d{3}$")
+
+def versioned_model_name(model_name: str) -> str:
+    """Maps an alias such as "gemini-1.5-flash-latest" to a versioned name context caches accept."""
+    if _MODEL_VERSION_RE.search(model_name):
+        return model_name
+    base = model_name[:-len("-latest")] if model_name.endswith("-latest") else model_name
+    return f"{base}-{DEFAULT_CACHE_MODEL_VERSION}"
+
+class CacheAffinityLost(RuntimeError):
+    """
+    The key owning a context cache failed. The cache lives in that key's project,
+    so the caller must resend the full prompt without `cached_content_name`.
+    """
+
 class GeminiKeyRotator:
     """
     Manages a list of Gemini API keys and rotates them to handle rate limits.
@@ -21,16 +54,211 @@ class GeminiKeyRotator:
         
         # [Fix] Use asyncio Lock for thread-safe index updates
         self._index_lock = asyncio.Lock()
+        # Bounds concurrent generate calls (e.g. reviewer + security gathered together)
+        self._request_semaphore = asyncio.Semaphore(MAX_CONCURRENT_PER_KEY * len(keys))
+        self._flex_semaphore = asyncio.Semaphore(max(1, int(MAX_CONCURRENT_PER_KEY * len(keys) * FLEX_SLOT_SHARE)))
+
+        # [Optimization] Context caches created by this rotator (name -> CachedContent)
+        self._cached_contents: Dict[str, Any] = {}
+        # [Optimization] Sticky routing: cache name -> index of the key that owns it
+        self._cache_affinity: Dict[str, int] = {}
+        # Cache name -> monotonic expiry time (server-side TTL)
+        self._cache_expiry: Dict[str, float] = {}
+
+        # [Optimization] One pooled async client (gRPC channel, HTTP/2) per key, reused across calls.
+        # genai.configure() drops the SDK's default clients, so calling it per request
+        # paid a fresh TCP+TLS handshake every time.
+        self._async_clients: Dict[str, Any] = {}
+        self._configured_key: Optional[str] = None
         
-    async def _get_next_key(self) -> str:
-        """Safely retrieves the next key in round-robin fashion."""
+    @contextlib.asynccontextmanager
+    async def _request_slot(self, service_tier: Optional[str]):
+        """Request slot; "flex" calls additionally go through the capped background pool."""
+        async with contextlib.AsyncExitStack() as stack:
+            if service_tier == "flex":
+                await stack.enter_async_context(self._flex_semaphore)
+            await stack.enter_async_context(self._request_semaphore)
+            yield
+
+    async def _next_key_index(self) -> int:
         async with self._index_lock:
-            key = self.keys[self.current_index]
+            index = self.current_index
             self.current_index = (self.current_index + 1) % len(self.keys)
-        return key
+        return index
+
+    async def _get_next_key(self) -> str:
+        """Safely retrieves the next key in round-robin fashion."""
+        return self.keys[await self._next_key_index()]
+
+    async def _select_key(self, cached_content_name: Optional[str]) -> Tuple[str, Optional[int]]:
+        """Returns (api_key, pinned_index); cached-content requests stick to the cache owner."""
+        pinned_index = self._cache_affinity.get(cached_content_name) if cached_content_name else None
+        if pinned_index is not None:
+            return self.keys[pinned_index], pinned_index
+        # [Fix] Always rotate key on every attempt/retry
+        return await self._get_next_key(), None
+
+    @staticmethod
+    def _extract_usage(response: Any) -> Dict[str, int]:
+        usage_metadata = {}
+        if getattr(response, 'usage_metadata', None):
+            usage_metadata = {
+                "prompt_token_count": response.usage_metadata.prompt_token_count,
+                "candidates_token_count": response.usage_metadata.candidates_token_count,
+                "total_token_count": response.usage_metadata.total_token_count
+            }
+        return usage_metadata
+
+    def _on_exhausted(self, api_key: str, pinned_index: Optional[int], cached_content_name: Optional[str], error: Exception):
+        if pinned_index is not None:
+            logger.warning(f"Key {api_key[-4:]} owning cache {cached_content_name} exhausted. Dropping cache.")
+            self._invalidate_cache(cached_content_name)
+            raise CacheAffinityLost(f"Cache owner key exhausted: {error}") from error
+        logger.warning(f"Key {api_key[-4:]} exhausted (429). Rotating...")
+
+    def _invalidate_cache(self, cached_content_name: str):
+        self._cached_contents.pop(cached_content_name, None)
+        self._cache_affinity.pop(cached_content_name, None)
+        self._cache_expiry.pop(cached_content_name, None)
+
+    def is_cache_alive(self, cached_content_name: str, margin_seconds: float = 30) -> bool:
+        """True if the cache is known to this rotator and will not expire within `margin_seconds`."""
+        expiry = self._cache_expiry.get(cached_content_name)
+        return expiry is not None and time.monotonic() + margin_seconds < expiry
 
     def _configure_genai(self, api_key: str):
-        genai.configure(api_key=api_key)
+        # Only the context-cache APIs still use the SDK's global client
+        if api_key != self._configured_key:
+            genai.configure(api_key=api_key)
+            self._configured_key = api_key
+
+    def _get_async_client(self, api_key: str) -> Any:
+        client = self._async_clients.get(api_key)
+        if client is None:
+            client = glm.GenerativeServiceAsyncClient(
+                client_options=client_options_lib.ClientOptions(api_key=api_key)
+            )
+            self._async_clients[api_key] = client
+        return client
+
+    def make_embed_fn(self, model: str = "models/text-embedding-004") -> Callable[[str], List[float]]:
+        """
+        Blocking text -> embedding function (e.g. for SemanticCache) that rotates keys per call.
+        Uses explicit per-key clients rather than genai.configure(), so it cannot disturb the
+        global key that the context-cache APIs rely on.
+        """
+        clients = [
+            glm.GenerativeServiceClient(client_options=client_options_lib.ClientOptions(api_key=key))
+            for key in self.keys
+        ]
+        counter = itertools.count()
+
+        def embed(text: str) -> List[float]:
+            client = clients[next(counter) % len(clients)]
+            return genai.embed_content(model=model, content=text, client=client)["embedding"]
+
+        return embed
+
+    async def count_tokens(self, model_name: str, contents: List[Dict[str, Any]], tools: List[Any] = None) -> int:
+        """Exact prompt size as the model tokenizes it (contents plus tool declarations)."""
+        api_key = await self._get_next_key()
+        model = await self._build_model(api_key, model_name, None, None, tools, None)
+        response = await model.count_tokens_async(contents)
+        return response.total_tokens
+
+    async def create_context_cache(
+        self,
+        model_name: str,
+        contents: List[Dict[str, Any]],
+        system_instruction: Optional[str] = None,
+        tools: List[Any] = None,
+        ttl_seconds: int = 300
+    ) -> str:
+        """
+        Registers a stable prompt prefix as a Gemini CachedContent and returns its name.
+        Subsequent calls pass the name as `cached_content_name` and only send the tail.
+        """
+        key_index = await self._next_key_index()
+        self._configure_genai(self.keys[key_index])
+
+        cached = await asyncio.to_thread(
+            genai.caching.CachedContent.create,
+            model=versioned_model_name(model_name),
+            system_instruction=system_instruction,
+            contents=contents,
+            tools=tools,
+            ttl=datetime.timedelta(seconds=ttl_seconds)
+        )
+        self._cached_contents[cached.name] = cached
+        self._cache_affinity[cached.name] = key_index
+        self._cache_expiry[cached.name] = time.monotonic() + ttl_seconds
+        logger.info(f"Created context cache {cached.name} (ttl={ttl_seconds}s)")
+        return cached.name
+
+    async def extend_context_cache(self, cached_content_name: str, ttl_seconds: int = 300) -> bool:
+        """
+        Pushes out the TTL of a cache that has not expired yet. Much cheaper than recreating it,
+        which re-uploads (and re-bills) the whole prefix. Returns False if it is gone or unknown.
+        """
+        cached = self._cached_contents.get(cached_content_name)
+        expiry = self._cache_expiry.get(cached_content_name)
+        key_index = self._cache_affinity.get(cached_content_name)
+        if cached is None or expiry is None or key_index is None or time.monotonic() >= expiry:
+            return False
+        try:
+            self._configure_genai(self.keys[key_index])
+            await asyncio.to_thread(cached.update, ttl=datetime.timedelta(seconds=ttl_seconds))
+        except Exception as e:
+            logger.warning(f"Failed to extend context cache {cached_content_name}: {e}")
+            return False
+        self._cache_expiry[cached_content_name] = time.monotonic() + ttl_seconds
+        return True
+
+    async def delete_context_cache(self, cached_content_name: str):
+        """Deletes a superseded cache early instead of paying storage until its TTL runs out."""
+        cached = self._cached_contents.get(cached_content_name)
+        key_index = self._cache_affinity.get(cached_content_name)
+        self._invalidate_cache(cached_content_name)
+        if cached is None or key_index is None:
+            return
+        try:
+            self._configure_genai(self.keys[key_index])
+            await asyncio.to_thread(cached.delete)
+        except Exception as e:
+            logger.warning(f"Failed to delete context cache {cached_content_name}: {e}")
+
+    async def _build_model(
+        self,
+        api_key: str,
+        model_name: str,
+        generation_config: Dict[str, Any],
+        safety_settings: List[Dict[str, Any]],
+        tools: List[Any],
+        cached_content_name: Optional[str]
+    ) -> "genai.GenerativeModel":
+        if cached_content_name:
+            # Tools and the prefix live inside the cache, so they are not resent here.
+            cached = self._cached_contents.get(cached_content_name)
+            if cached is None:
+                self._configure_genai(api_key)
+                cached = await asyncio.to_thread(genai.caching.CachedContent.get, cached_content_name)
+                self._cached_contents[cached_content_name] = cached
+            model = genai.GenerativeModel.from_cached_content(
+                cached_content=cached,
+                generation_config=generation_config,
+                safety_settings=safety_settings
+            )
+        else:
+            model = genai.GenerativeModel(
+                model_name=model_name,
+                generation_config=generation_config,
+                safety_settings=safety_settings,
+                tools=tools
+            )
+
+        # Bind the pooled per-key client instead of the SDK's global default
+        model._async_client = self._get_async_client(api_key)
+        return model
 
     async def call_gemini_with_rotation(
         self, 
@@ -39,47 +267,39 @@ class GeminiKeyRotator:
         generation_config: Dict[str, Any] = None,
         safety_settings: List[Dict[str, Any]] = None,
         tools: List[Any] = None,
-        cached_content_name: str = None # [Compat] Kept for interface compatibility
+        cached_content_name: str = None,
+        complexity: Optional[str] = None,
+        service_tier: Optional[str] = None
     ) -> Tuple[str, Dict[str, int]]:
         """
         Calls Gemini API with automatic key rotation on 429 errors.
+        `complexity` ("simple" / "complex") routes the call to the matching MODEL_TIERS model.
+        `service_tier="flex"` marks non-urgent work that must leave request slots free for interactive calls.
+        When `cached_content_name` is set, the request is served on top of that context cache
+        and pinned to the key that created it (rotating would duplicate the cache per project).
+        Raises CacheAffinityLost if that key fails.
         """
-        if cached_content_name:
-            # Logic for caching could be implemented here if needed, 
-            # but ensuring it doesn't break rotation.
-            pass
-
+        if complexity and not cached_content_name:
+            # Cached content is bound to the model it was created with
+            model_name = MODEL_TIERS.get(complexity, model_name)
         max_retries = len(self.keys) * 2 
         retries = 0
         last_error = None
 
         while retries < max_retries:
-            # [Fix] Always rotate key on every attempt/retry
-            api_key = await self._get_next_key()
-            self._configure_genai(api_key)
+            api_key, pinned_index = await self._select_key(cached_content_name)
             
             try:
-                model = genai.GenerativeModel(
-                    model_name=model_name,
-                    generation_config=generation_config,
-                    safety_settings=safety_settings,
-                    tools=tools
+                model = await self._build_model(
+                    api_key, model_name, generation_config, safety_settings, tools, cached_content_name
                 )
                 
-                response = await model.generate_content_async(contents)
-                
-                usage_metadata = {}
-                if hasattr(response, 'usage_metadata'):
-                    usage_metadata = {
-                        "prompt_token_count": response.usage_metadata.prompt_token_count,
-                        "candidates_token_count": response.usage_metadata.candidates_token_count,
-                        "total_token_count": response.usage_metadata.total_token_count
-                    }
-
-                return response.text, usage_metadata
+                async with self._request_slot(service_tier):
+                    response = await model.generate_content_async(contents)
+                return response.text, self._extract_usage(response)
 
             except exceptions.ResourceExhausted as e:
-                logger.warning(f"Key {api_key[-4:]} exhausted (429). Rotating...")
+                self._on_exhausted(api_key, pinned_index, cached_content_name, e)
                 retries += 1
                 last_error = e
                 await asyncio.sleep(1) # Backoff
@@ -89,3 +309,51 @@ class GeminiKeyRotator:
                 raise e
         
         raise RuntimeError(f"All keys exhausted. Last error: {last_error}")
+
+    async def call_gemini_with_rotation_stream(
+        self,
+        model_name: str,
+        contents: List[Dict[str, Any]],
+        generation_config: Dict[str, Any] = None,
+        safety_settings: List[Dict[str, Any]] = None,
+        tools: List[Any] = None,
+        cached_content_name: str = None,
+        service_tier: Optional[str] = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, int]]]:
+        """
+        Streaming variant of call_gemini_with_rotation. Yields (text_chunk, usage_so_far).
+        Keys are only rotated before the first chunk; a failure mid-stream is raised to the caller.
+        """
+        max_retries = len(self.keys) * 2
+        retries = 0
+        last_error = None
+
+        while retries < max_retries:
+            api_key, pinned_index = await self._select_key(cached_content_name)
+            started = False
+
+            try:
+                model = await self._build_model(
+                    api_key, model_name, generation_config, safety_settings, tools, cached_content_name
+                )
+
+                async with self._request_slot(service_tier):
+                    response = await model.generate_content_async(contents, stream=True)
+                    async for chunk in response:
+                        started = True
+                        yield chunk.text, self._extract_usage(chunk)
+                return
+
+            except exceptions.ResourceExhausted as e:
+                if started:
+                    raise
+                self._on_exhausted(api_key, pinned_index, cached_content_name, e)
+                retries += 1
+                last_error = e
+                await asyncio.sleep(1) # Backoff
+
+            except Exception as e:
+                logger.error(f"API Error with key {api_key[-4:]}: {e}")
+                raise e
+
+        raise RuntimeError(f"All keys exhausted. Last error: {last_error}")
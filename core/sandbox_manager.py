@@ -1,39 +1,151 @@
-from typing import Dict
+from typing import Dict, List, Optional, Set, Tuple
+from tools import sandbox as sandbox_registry
 from tools.sandbox import StatefulSandbox
 import atexit
 import logging
+import os
+import threading
+import time
 
 logger = logging.getLogger("SandboxManager")
 
-# 全局单例，用于存储活跃的沙箱
-# Key: task_id, Value: StatefulSandbox Instance
-active_sandboxes: Dict[str, StatefulSandbox] = {}
+# 活跃沙箱统一登记在 tools.sandbox 的注册表中 (StatefulSandbox 创建时自动注册)，
+# 本模块只负责按任务复用、空闲回收与退出清理。
 
-def get_sandbox(task_id: str) -> StatefulSandbox:
-    return active_sandboxes.get(task_id)
+# [Optimization] 沙箱在多轮迭代间保持存活，空闲超过该时长才回收
+SANDBOX_IDLE_TIMEOUT = 600
+# 任务仍在运行 (尚未 release_sandbox) 的沙箱只在长时间无任何活动时才回收 (防止泄漏)，
+# 以免一次很长的 LLM 调用期间沙箱被其他任务的回收顺带删除
+SANDBOX_ACTIVE_IDLE_TIMEOUT = 3600
+_last_used: Dict[str, float] = {}
+_active_tasks: Set[str] = set()
+_pool_lock = threading.Lock()
+
+# [Optimization] Warm pool: 任务结束后容器不销毁，按工作区暂存 (仍在运行)，
+# 同一工作区的下一个任务直接接管，跳过容器启动。工作区是启动时挂载的，所以不能跨工作区复用。
+SANDBOX_WARM_POOL_SIZE = int(os.getenv("SANDBOX_WARM_POOL_SIZE", "2"))
+# workspace_root -> [(暂存时间, sandbox)]
+_warm_pool: Dict[str, List[Tuple[float, StatefulSandbox]]] = {}
+
+def get_sandbox(task_id: str) -> Optional[StatefulSandbox]:
+    sandbox = sandbox_registry.get_sandbox(task_id)
+    if sandbox is not None:
+        _last_used[task_id] = time.monotonic()
+    return sandbox
+
+def get_or_create_sandbox(task_id: str, workspace_root: Optional[str]) -> Optional[StatefulSandbox]:
+    """
+    返回任务的常驻沙箱，不存在时创建 (阻塞调用，需放在线程中执行)。
+    顺带回收其他任务的空闲沙箱。
+    """
+    evict_idle_sandboxes()
+    with _pool_lock:
+        sandbox = get_sandbox(task_id)
+        if sandbox is None and workspace_root:
+            sandbox = _take_warm(task_id, workspace_root) or StatefulSandbox(task_id, workspace_root)
+            _last_used[task_id] = time.monotonic()
+        if sandbox is not None:
+            _active_tasks.add(task_id)
+        return sandbox
+
+def _take_warm(task_id: str, workspace_root: str) -> Optional[StatefulSandbox]:
+    """从 warm pool 取出同一工作区的容器并移交给 task_id；调用方需持有 _pool_lock。"""
+    parked = _warm_pool.get(workspace_root)
+    while parked:
+        _, sandbox = parked.pop()
+        try:
+            sandbox.rebind(task_id)
+            logger.info(f"Reusing warm sandbox for task {task_id}")
+            return sandbox
+        except Exception as e:
+            logger.warning(f"Discarding stale warm sandbox: {e}")
+            sandbox.cleanup(remove_from_registry=False)
+    return None
+
+def release_sandbox(task_id: str):
+    """
+    任务结束：沙箱清理后放回 warm pool；池满或无法还原到干净状态 (例如装过包) 时销毁。
+    阻塞调用，需放在线程中执行。
+    """
+    _last_used.pop(task_id, None)
+    _active_tasks.discard(task_id)
+    sandbox = sandbox_registry.get_sandbox(task_id)
+    if sandbox is None:
+        return
+    with _pool_lock:
+        has_room = len(_warm_pool.get(sandbox.workspace_root, [])) < SANDBOX_WARM_POOL_SIZE
+    try:
+        reusable = has_room and sandbox.reset_for_reuse()
+    except Exception as e:
+        logger.warning(f"Sandbox reset failed for {task_id}: {e}")
+        reusable = False
+    if reusable:
+        with _pool_lock:
+            parked = _warm_pool.setdefault(sandbox.workspace_root, [])
+            if len(parked) < SANDBOX_WARM_POOL_SIZE:
+                sandbox_registry.unregister_sandbox(task_id)
+                parked.append((time.monotonic(), sandbox))
+                return
+    unregister_sandbox(task_id)
+
+def evict_idle_sandboxes(max_idle: float = SANDBOX_IDLE_TIMEOUT):
+    now = time.monotonic()
+    for task_id, last_used in list(_last_used.items()):
+        sandbox = sandbox_registry.get_sandbox(task_id)
+        if sandbox is not None:
+            # 每次 exec 都会刷新 sandbox.last_used
+            last_used = max(last_used, sandbox.last_used)
+        limit = max(max_idle, SANDBOX_ACTIVE_IDLE_TIMEOUT) if task_id in _active_tasks else max_idle
+        if now - last_used > limit:
+            logger.info(f"Evicting idle sandbox for task {task_id}")
+            unregister_sandbox(task_id)
+
+    # 暂存过久的 warm 容器同样回收
+    expired = []
+    with _pool_lock:
+        for workspace_root, parked in _warm_pool.items():
+            expired.extend(sb for parked_at, sb in parked if now - parked_at > max_idle)
+            parked[:] = [(t, sb) for t, sb in parked if now - t <= max_idle]
+    for sandbox in expired:
+        sandbox.cleanup(remove_from_registry=False)
+
+def warmup_sandbox(task_id: str, workspace_root: Optional[str] = None):
+    """[Optimization] 提前确保沙箱容器已运行 (阻塞调用，需放在线程中执行)"""
+    sandbox = get_or_create_sandbox(task_id, workspace_root)
+    if sandbox is not None:
+        sandbox.ensure_running()
 
 def register_sandbox(task_id: str, sandbox: StatefulSandbox):
-    active_sandboxes[task_id] = sandbox
+    sandbox_registry.register_sandbox(task_id, sandbox)
+    _last_used[task_id] = time.monotonic()
 
 def unregister_sandbox(task_id: str):
-    if task_id in active_sandboxes:
-        active_sandboxes[task_id].close_session()
-        del active_sandboxes[task_id]
+    _last_used.pop(task_id, None)
+    _active_tasks.discard(task_id)
+    sandbox = sandbox_registry.get_sandbox(task_id)
+    if sandbox is not None:
+        try:
+            # cleanup() 会同时从注册表中移除
+            sandbox.cleanup()
+        except Exception as e:
+            logger.error(f"Failed to close sandbox {task_id}: {e}")
 
 # [Cleanup Fix] 注册进程退出时的清理函数
 def cleanup_all_sandboxes():
-    if not active_sandboxes:
-        return
-    
-    logger.info(f"🧹 [Shutdown] Cleaning up {len(active_sandboxes)} active sandboxes...")
-    # 转换为列表以避免在迭代时修改字典
-    for task_id in list(active_sandboxes.keys()):
+    _last_used.clear()
+    _active_tasks.clear()
+    with _pool_lock:
+        parked = [sb for entries in _warm_pool.values() for _, sb in entries]
+        _warm_pool.clear()
+    for sandbox in parked:
         try:
-            logger.info(f"   Killing sandbox for task {task_id}")
-            active_sandboxes[task_id].close_session()
+            sandbox.cleanup(remove_from_registry=False)
         except Exception as e:
-            logger.error(f"   Failed to close sandbox {task_id}: {e}")
-    
-    active_sandboxes.clear()
+            logger.error(f"Failed to close warm sandbox: {e}")
+    try:
+        # 同时清理注册表中的沙箱与遗留的同名容器
+        sandbox_registry.cleanup_all_sandboxes()
+    except Exception as e:
+        logger.error(f"Sandbox cleanup failed: {e}")
 
 atexit.register(cleanup_all_sandboxes)
@@ -0,0 +1,167 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import orjson
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# numpy 是可选依赖 (chromadb 会间接安装)，缺失时仅启用精确匹配层
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger("SemanticCache")
+
+# 语义层默认关闭：每次查询多一次 embedding 调用，且近似命中需按场景评估
+SEMANTIC_CACHE_ENABLED = os.getenv("LLM_SEMANTIC_CACHE", "").lower() in ("1", "true", "yes")
+
+# 持久化层 (跨进程 / 重启复用 LLM 响应) 默认关闭：模型输出只有在显式设置 LLM_CACHE_DIR 时才写入磁盘
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR") or None
+
+class SemanticCache:
+    """
+    [Optimization] 进程内 LLM 响应缓存
+    Tier 1: 对 prompt 做 SHA-256 精确匹配 (零成本命中重试时的相同代码)。
+    Tier 2: 可选的 embedding 余弦相似度匹配 (需要 numpy 和 embed_fn)。
+    Tier 3: 可选的磁盘持久化 (persist_dir)，按精确哈希存储，值需可被 JSON 序列化。
+    """
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        ttl: int = 3600,
+        max_entries: int = 512,
+        embed_fn: Optional[Callable[[str], List[float]]] = None,
+        persist_dir: Optional[str] = None
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embed_fn = embed_fn if NUMPY_AVAILABLE else None
+        self.persist_dir = persist_dir
+
+        # key -> (timestamp, value)，按 LRU 顺序排列
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        # key -> 归一化后的 embedding
+        self._vectors: Dict[str, Any] = {}
+        # [Optimization] Single-flight: key -> 进行中的查询/计算，并发的相同请求共享一次上游调用
+        self._inflight: Dict[str, "asyncio.Task[Any]"] = {}
+
+    @staticmethod
+    def _hash(prompt: str) -> str:
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def _evict(self, key: str):
+        self._entries.pop(key, None)
+        self._vectors.pop(key, None)
+
+    def _get_exact(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created, value = entry
+        if time.monotonic() - created > self.ttl:
+            self._evict(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _get_similar(self, vector: Any) -> Optional[Any]:
+        if not self._vectors:
+            return None
+        keys = list(self._vectors.keys())
+        matrix = np.stack([self._vectors[k] for k in keys])
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return self._get_exact(keys[best])
+
+    def _put(self, key: str, value: Any, vector: Any = None):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        if vector is not None:
+            self._vectors[key] = vector
+        while len(self._entries) > self.max_entries:
+            oldest, _ = self._entries.popitem(last=False)
+            self._vectors.pop(oldest, None)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.persist_dir, key[:2], f"{key}.json")
+
+    def _load_disk(self, key: str) -> Optional[Any]:
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                data = orjson.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if time.time() - data.get("created", 0) > self.ttl:
+            return None
+        value = data.get("value")
+        # JSON 没有 tuple，(text, usage) 这类返回值需还原
+        return tuple(value) if isinstance(value, list) else value
+
+    def _save_disk(self, key: str, value: Any):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps({"created": time.time(), "value": value}))
+            os.replace(tmp_path, path)
+        except (OSError, TypeError) as e:
+            logger.warning(f"Failed to persist cache entry {key[:8]}: {e}")
+
+    async def _embed(self, prompt: str) -> Any:
+        try:
+            raw = await asyncio.to_thread(self.embed_fn, prompt)
+        except Exception as e:
+            logger.warning(f"Embedding failed, skipping semantic tier: {e}")
+            return None
+        vector = np.asarray(raw, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    async def get_or_compute(self, prompt: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns the cached value for `prompt`, or awaits `compute()` and stores its result."""
+        key = self._hash(prompt)
+        value = self._get_exact(key)
+        if value is not None:
+            logger.debug(f"Exact cache hit {key[:8]}")
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._lookup_or_compute(key, prompt, compute))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            logger.debug(f"Coalesced in-flight request {key[:8]}")
+        # shield: 某个调用方被取消不影响其他等待同一结果的调用方
+        return await asyncio.shield(task)
+
+    async def _lookup_or_compute(self, key: str, prompt: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        if self.persist_dir:
+            value = await asyncio.to_thread(self._load_disk, key)
+            if value is not None:
+                logger.debug(f"Disk cache hit {key[:8]}")
+                self._put(key, value)
+                return value
+
+        vector = None
+        if self.embed_fn:
+            vector = await self._embed(prompt)
+            if vector is not None:
+                value = self._get_similar(vector)
+                if value is not None:
+                    logger.debug(f"Semantic cache hit for {key[:8]}")
+                    return value
+
+        value = await compute()
+        self._put(key, value, vector)
+        if self.persist_dir:
+            await asyncio.to_thread(self._save_disk, key, value)
+        return value
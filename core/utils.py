@@ -1,11 +1,20 @@
 import os
 import logging
+import functools
 
 logger = logging.getLogger("Utils")
 
+# [Optimization] Prompt 模板按进程缓存；开发时设置 PROMPT_HOT_RELOAD=1 以每次重新读取
+PROMPT_HOT_RELOAD = os.getenv("PROMPT_HOT_RELOAD", "").lower() in ("1", "true", "yes")
+
 # [Maintenance] 集中管理费率配置 (USD per 1M tokens)
 # 更新价格以匹配 gemini-1.5 系列 (假设价格，实际请参考 Google Cloud 定价)
 PRICING_TIERS = {
+    "flash-8b": {
+        "input": 0.0375,
+        "output": 0.15,
+        "description": "Gemini 1.5 Flash-8B (Lightweight tasks)"
+    },
     "flash": {
         "input": 0.075,
         "output": 0.30,
@@ -23,32 +32,42 @@ PRICING_TIERS = {
     }
 }
 
+@functools.lru_cache(maxsize=64)
+def _read_prompt_file(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
 def load_prompt(base_path: str, filename: str) -> str:
-    """加载 Prompt 模板文件"""
+    """加载 Prompt 模板文件 (读取失败不会被缓存)"""
+    path = os.path.join(base_path, filename)
+    if PROMPT_HOT_RELOAD:
+        _read_prompt_file.cache_clear()
     try:
-        path = os.path.join(base_path, filename)
-        with open(path, "r", encoding="utf-8") as f:
-            return f.read()
+        return _read_prompt_file(path)
     except Exception as e:
         logger.error(f"Failed to load prompt {filename}: {e}")
         return ""
 
-def calculate_cost(model_name: str, input_tokens: int, output_tokens: int) -> float:
-    """
-    [Roo Code Soul] 计算 Token 成本 (USD)
-    使用集中管理的 PRICING_TIERS 进行计算。
-    """
+@functools.lru_cache(maxsize=32)
+def _rates_per_token(model_name: str) -> tuple:
+    """按模型名解析费率 (每个模型名只匹配一次)，返回 (input, output) USD / token"""
     model_lower = model_name.lower()
     
     # [Config Update] 改进匹配逻辑，支持 "gemini-1.5-flash" 或 "flash"
-    if "flash" in model_lower:
+    if "flash-8b" in model_lower:
+        rate = PRICING_TIERS["flash-8b"]
+    elif "flash" in model_lower:
         rate = PRICING_TIERS["flash"]
     elif "pro" in model_lower:
         rate = PRICING_TIERS["pro"]
     else:
         rate = PRICING_TIERS["default"]
-        
-    input_cost = (input_tokens / 1_000_000) * rate["input"]
-    output_cost = (output_tokens / 1_000_000) * rate["output"]
-    
-    return round(input_cost + output_cost, 6)
+    return rate["input"] / 1_000_000, rate["output"] / 1_000_000
+
+def calculate_cost(model_name: str, input_tokens: int, output_tokens: int) -> float:
+    """
+    [Roo Code Soul] 计算 Token 成本 (USD)
+    使用集中管理的 PRICING_TIERS 进行计算。
+    """
+    input_rate, output_rate = _rates_per_token(model_name)
+    return round(input_tokens * input_rate + output_tokens * output_rate, 6)
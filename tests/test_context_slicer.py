@@ -0,0 +1,23 @@
+from core.context_slicer import EXCERPT_HEADER, MAX_FILE_CONTEXT_CHARS, _excerpt
+
+
+def _body(excerpt: str) -> str:
+    header, body = excerpt.split("\n", 1)
+    assert header.startswith(EXCERPT_HEADER)
+    return body
+
+
+def test_excerpt_long_preceding_line_keeps_cursor_and_window():
+    content = "a" * 50000 + "\nb"
+    body = _body(_excerpt(content, cursor_line=2))
+    assert body.endswith("\nb")
+    # The window is cut inside the long line instead of skipping all of it
+    assert len(body) == MAX_FILE_CONTEXT_CHARS
+
+
+def test_excerpt_aligns_to_whole_lines_when_possible():
+    content = "".join(f"line {i}\n" for i in range(5000))
+    body = _body(_excerpt(content, cursor_line=2500))
+    assert body.startswith("line ")
+    assert body.endswith("\n")
+    assert "line 2499\n" in body
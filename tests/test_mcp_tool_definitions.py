@@ -0,0 +1,52 @@
+import random
+import re
+
+from core.mcp_tool_definitions import MCPToolDefinitions, _scan_param_tags
+
+
+def _regex_param_tags(block: str):
+    # The pattern the forward scan replaced
+    return re.findall(r'<(\w+)>(.*?)</\1>', block, re.DOTALL)
+
+
+def test_scan_param_tags_matches_former_regex():
+    cases = [
+        "<filepath>a.py</filepath><content>x = 1</content>",
+        "<content>if a < b:\n    pass</content>",
+        "<outer><inner>v</inner></outer>",
+        "<a>unclosed <b>closed</b>",
+        "<a>one</a><a>two</a>",
+        "< a>spaced</a><>empty</>",
+        "<file_path>p</file_path><x1>1</x1>",
+        "<a>nested <a>same</a> name</a>",
+        "",
+    ]
+    rng = random.Random(0)
+    alphabet = ["<", ">", "/", "a", "b", "_", "1", " ", "\n", "<a>", "</a>", "<b>", "</b>"]
+    cases += ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40))) for _ in range(2000)]
+    for block in cases:
+        assert _scan_param_tags(block) == _regex_param_tags(block), block
+
+
+def test_parse_tool_calls_multiple_blocks():
+    output = (
+        "Plan first.\n"
+        "<tool_code><name>write_to_file</name><parameters>"
+        "<filepath>app.py</filepath><content>\nprint('hi')\n</content>"
+        "</parameters></tool_code>\n"
+        "<tool_code><name>execute_command</name><parameters><command>python app.py</command></parameters></tool_code>"
+    )
+    assert MCPToolDefinitions.parse_tool_calls(output) == [
+        {"name": "write_to_file", "parameters": {"filepath": "app.py", "content": "print('hi')"}},
+        {"name": "execute_command", "parameters": {"command": "python app.py"}},
+    ]
+
+
+def test_parse_tool_calls_skips_block_closed_after_next_open():
+    output = (
+        "<tool_code><name>read_file</name>"
+        "<tool_code><name>read_file</name><parameters><filepath>b.py</filepath></parameters></tool_code>"
+    )
+    assert MCPToolDefinitions.parse_tool_calls(output) == [
+        {"name": "read_file", "parameters": {"filepath": "b.py"}},
+    ]
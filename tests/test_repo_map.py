@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from core import repo_map
+from core.repo_map import RepositoryMapper
+
+
+@pytest.fixture
+def mapper(tmp_path, monkeypatch):
+    workspace = tmp_path / "ws"
+    (workspace / "pkg").mkdir(parents=True)
+    (workspace / "main.py").write_text("def main(): pass\n")
+    (workspace / "pkg" / "a.py").write_text("class A: pass\n")
+    (workspace / "pkg" / "b.py").write_text("class B: pass\n")
+    monkeypatch.setattr(repo_map, "REPO_MAP_CACHE_DIR", str(tmp_path / "cache"))
+    # Skeletons are what tree-sitter would extract; the test only checks which files get parsed
+    monkeypatch.setattr(repo_map, "TREE_SITTER_AVAILABLE", True)
+    parsed = []
+
+    def fake_parse(self, full_path, rel_path, lang_name):
+        parsed.append(rel_path)
+        with open(full_path, encoding="utf-8") as f:
+            return f"{rel_path}:\n  {f.read().split(':')[0]}"
+
+    monkeypatch.setattr(RepositoryMapper, "_parse_file", fake_parse)
+    return RepositoryMapper(str(workspace)), workspace, parsed
+
+
+def test_map_groups_entries_by_directory(mapper):
+    m, _, _ = mapper
+    body = m.generate_map().split("\n\n", 1)[1]
+    assert body == "[./]\n\nmain.py:\n  def main()\n\n[pkg/]\n\na.py:\n  class A\n\nb.py:\n  class B"
+
+
+def test_unchanged_workspace_reuses_cached_map(mapper):
+    m, _, parsed = mapper
+    first = m.generate_map()
+    parsed.clear()
+    assert RepositoryMapper(m.root_path).generate_map() == first
+    assert parsed == []
+
+
+def test_only_changed_files_are_reparsed(mapper):
+    m, workspace, parsed = mapper
+    m.generate_map()
+    parsed.clear()
+    changed = workspace / "pkg" / "b.py"
+    changed.write_text("class Renamed: pass\n")
+    st = changed.stat()
+    os.utime(changed, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    result = m.generate_map()
+    assert parsed == [os.path.join("pkg", "b.py")]
+    assert "class Renamed" in result and "class A" in result
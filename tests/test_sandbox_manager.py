@@ -0,0 +1,76 @@
+import time
+from unittest import mock
+
+import pytest
+
+from core import sandbox_manager
+from tools import sandbox as sandbox_registry
+from tools.sandbox import StatefulSandbox
+
+
+def _sandbox(task_id, workspace_root, diff=()):
+    """A StatefulSandbox bound to a mock container, without starting Docker."""
+    sb = StatefulSandbox.__new__(StatefulSandbox)
+    sb.task_id = task_id
+    sb.client = mock.MagicMock()
+    sb.container_name = f"gemini_sandbox_{task_id}"
+    sb.workspace_root = workspace_root
+    sb.container = mock.MagicMock()
+    sb.container.diff.return_value = [{"Path": p, "Kind": 1} for p in diff]
+    sb.last_used = time.monotonic()
+    sandbox_manager.register_sandbox(task_id, sb)
+    return sb
+
+
+@pytest.fixture(autouse=True)
+def clean_pool():
+    yield
+    sandbox_manager._warm_pool.clear()
+    sandbox_manager._last_used.clear()
+    sandbox_manager._active_tasks.clear()
+    sandbox_registry._SANDBOX_REGISTRY.clear()
+
+
+def test_release_resets_and_parks_clean_sandbox():
+    sb = _sandbox("t1", "/ws", diff=["/tmp", "/tmp/x", "/workspace/out.txt"])
+    sandbox_manager.release_sandbox("t1")
+
+    command = sb.container.exec_run.call_args.args[0][-1]
+    assert "kill -9 -1" in command and "rm -rf /tmp/*" in command
+    assert sandbox_registry.get_sandbox("t1") is None
+    assert [s for _, s in sandbox_manager._warm_pool["/ws"]] == [sb]
+    sb.client.containers.get.assert_not_called()
+
+
+def test_release_destroys_sandbox_with_changed_filesystem():
+    sb = _sandbox("t1", "/ws", diff=["/usr/local/lib/python3.10/site-packages/requests"])
+    sandbox_manager.release_sandbox("t1")
+
+    assert sandbox_manager._warm_pool.get("/ws", []) == []
+    assert sandbox_registry.get_sandbox("t1") is None
+    sb.client.containers.get.return_value.remove.assert_called_once_with(force=True)
+
+
+def test_next_task_on_same_workspace_takes_parked_sandbox():
+    sb = _sandbox("t1", "/ws")
+    sandbox_manager.release_sandbox("t1")
+
+    assert sandbox_manager.get_or_create_sandbox("t2", "/ws") is sb
+    assert sb.task_id == "t2"
+    sb.container.rename.assert_called_once_with("gemini_sandbox_t2")
+    assert sandbox_registry.get_sandbox("t2") is sb
+
+
+def test_idle_eviction_spares_running_tasks():
+    running = _sandbox("running", "/ws")
+    idle = _sandbox("idle", "/ws")
+    sandbox_manager._active_tasks.add("running")
+    stale = time.monotonic() - sandbox_manager.SANDBOX_IDLE_TIMEOUT - 1
+    for task_id, sb in (("running", running), ("idle", idle)):
+        sandbox_manager._last_used[task_id] = stale
+        sb.last_used = stale
+
+    sandbox_manager.evict_idle_sandboxes()
+
+    assert sandbox_registry.get_sandbox("running") is running
+    assert sandbox_registry.get_sandbox("idle") is None
@@ -1,16 +1,15 @@
+import asyncio
 import requests
 import socket
 import ipaddress
 import logging
+import importlib.util
 from urllib.parse import urlparse, urlunparse
 from typing import Optional
 
 # Optional Playwright support
-try:
-    from playwright.async_api import async_playwright
-    PLAYWRIGHT_AVAILABLE = True
-except ImportError:
-    PLAYWRIGHT_AVAILABLE = False
+# [Optimization] Probe only; the heavy import happens on the first screenshot
+PLAYWRIGHT_AVAILABLE = importlib.util.find_spec("playwright") is not None
 
 logger = logging.getLogger(__name__)
 
@@ -87,7 +86,8 @@ class BrowserTool:
             return "Error: Playwright not installed."
 
         # [Fix] Security: Re-validate URL for Playwright & Check Scheme
-        if not self._is_safe_url(url):
+        # (DNS resolution blocks, so it runs off the event loop)
+        if not await asyncio.to_thread(self._is_safe_url, url):
              logger.warning(f"🚫 Blocked screenshot request for unsafe URL: {url}")
              return "Error: URL blocked by security policy."
 
@@ -96,6 +96,7 @@ class BrowserTool:
             return "Error: Only HTTP/HTTPS protocols are supported for screenshots."
 
         try:
+            from playwright.async_api import async_playwright
             async with async_playwright() as p:
                 browser = await p.chromium.launch(headless=True)
                 page = await browser.new_page()
@@ -2,10 +2,13 @@ import docker
 import os
 import logging
 import threading
+import time
 from typing import Tuple, List, Dict, Optional
 
 logger = logging.getLogger(__name__)
 
+SANDBOX_BASE_IMAGE = "python:3.10-slim"
+
 # [Fix] Global Registry to track active sandboxes by Task ID
 # Used to retrieve the correct container instance in nodes.py
 _SANDBOX_REGISTRY: Dict[str, 'StatefulSandbox'] = {}
@@ -25,6 +28,15 @@ def unregister_sandbox(task_id: str):
         if task_id in _SANDBOX_REGISTRY:
             del _SANDBOX_REGISTRY[task_id]
 
+def pull_base_image():
+    """Pulls the sandbox base image ahead of the first task (the dominant cold-start cost)."""
+    client = docker.from_env()
+    try:
+        client.images.get(SANDBOX_BASE_IMAGE)
+    except docker.errors.ImageNotFound:
+        logger.info(f"Pulling sandbox base image {SANDBOX_BASE_IMAGE}...")
+        client.images.pull(SANDBOX_BASE_IMAGE)
+
 def cleanup_all_sandboxes():
     """Global cleanup function used by api_server's suicide pact."""
     client = docker.from_env()
@@ -34,7 +46,8 @@ def cleanup_all_sandboxes():
     with _REGISTRY_LOCK:
         for task_id, sb in list(_SANDBOX_REGISTRY.items()):
             try:
-                sb.cleanup()
+                # The registry lock is held here (and is not re-entrant); clear it below instead
+                sb.cleanup(remove_from_registry=False)
             except Exception as e:
                 logger.error(f"Error cleaning registry sandbox {task_id}: {e}")
         _SANDBOX_REGISTRY.clear()
@@ -70,6 +83,8 @@ class StatefulSandbox:
 
         self.workspace_root = workspace_root
         self.container = None
+        # monotonic time of the last exec; idle eviction reads it
+        self.last_used = time.monotonic()
         
         self._start_container()
         register_sandbox(task_id, self)
@@ -81,7 +96,7 @@ class StatefulSandbox:
             
             logger.info(f"Starting sandbox container: {self.container_name}")
             self.container = self.client.containers.run(
-                "python:3.10-slim",
+                SANDBOX_BASE_IMAGE,
                 command="tail -f /dev/null", # Keep alive command
                 name=self.container_name,
                 detach=True,
@@ -103,6 +118,55 @@ class StatefulSandbox:
             logger.error(f"Failed to start sandbox: {e}")
             raise e
 
+    def ensure_running(self):
+        """
+        [Optimization] Warm-up hook: makes sure the container is up before the first exec,
+        so callers can overlap Docker startup with other work (e.g. LLM generation).
+        """
+        if self.container is None:
+            self._start_container()
+            return
+        try:
+            self.container.reload()
+        except docker.errors.NotFound:
+            # Removed externally: recreate
+            self._start_container()
+            return
+        if self.container.status != "running":
+            logger.info(f"Restarting sandbox container: {self.container_name}")
+            self.container.start()
+
+    def rebind(self, task_id: str):
+        """
+        [Optimization] Hands a parked, still-running container over to another task
+        (warm pool): no container start, no image pull.
+        """
+        self.task_id = task_id
+        self.last_used = time.monotonic()
+        self.container_name = f"gemini_sandbox_{task_id}"
+        if self.container is not None:
+            self.container.rename(self.container_name)
+        register_sandbox(task_id, self)
+
+    def reset_for_reuse(self) -> bool:
+        """
+        Prepares a finished task's container for the warm pool: kills leftover processes and
+        empties /tmp. Returns False when it cannot be made clean (the task changed the filesystem,
+        e.g. pip installs); the caller then destroys it.
+        """
+        if self.container is None:
+            return False
+        # kill -1 signals every process except PID 1 (the keep-alive tail) and the shell itself
+        self.container.exec_run(["/bin/sh", "-c", "kill -9 -1; rm -rf /tmp/* /tmp/.[!.]* /tmp/..?*"])
+        changed = [
+            c["Path"] for c in self.container.diff() or []
+            if not (c["Path"] in ("/tmp", "/workspace") or c["Path"].startswith(("/tmp/", "/workspace/")))
+        ]
+        if changed:
+            logger.info(f"Not pooling {self.container_name}: filesystem changed ({changed[0]}, ...)")
+            return False
+        return True
+
     def execute_code(self, code: str, timeout: int = 30) -> Tuple[str, str, List[Dict[str, str]]]:
         """
         Executes Python code inside the container.
@@ -110,6 +174,7 @@ class StatefulSandbox:
         """
         if not self.container:
             raise RuntimeError("Container not running")
+        self.last_used = time.monotonic()
 
         # We execute via python -c. For complex scripts, writing to a temp file inside container is better.
         # Here we use a simple approach.
@@ -148,6 +213,7 @@ class StatefulSandbox:
         """Executes a raw shell command."""
         if not self.container:
             raise RuntimeError("Container not running")
+        self.last_used = time.monotonic()
             
         try:
             exec_result = self.container.exec_run(
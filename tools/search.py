@@ -23,7 +23,7 @@ class GoogleSearchTool:
             for res in response.get("results", []):
                 context.append(f"Source: {res.get('title')}\nURL: {res.get('url')}\nContent: {res.get('content', '')[:500]}")
             return "\n---\n".join(context)
-        except:
+        except Exception:
             return self._fallback_search(query)
 
     def _fallback_search(self, query: str) -> str:
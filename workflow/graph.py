@@ -1,9 +1,12 @@
-from typing import Any, Dict
+from typing import TYPE_CHECKING, Any, Dict
 from langgraph.graph import StateGraph, END
 from agents.crews.coding_crew.state import CodingCrewState
 from core.rotator import GeminiKeyRotator
-from tools.memory import VectorMemoryTool
-from tools.search import GoogleSearchTool
+
+# [Optimization] Annotation-only imports: loading this module must not pull in chromadb / tavily
+if TYPE_CHECKING:
+    from tools.memory import VectorMemoryTool
+    from tools.search import GoogleSearchTool
 
 from agents.crews.coding_crew.graph import build_coding_crew_graph
 
@@ -11,8 +14,8 @@ AgentGraphState = CodingCrewState
 
 def build_agent_workflow(
     rotator: GeminiKeyRotator, 
-    memory: VectorMemoryTool, 
-    search: GoogleSearchTool, 
+    memory: "VectorMemoryTool", 
+    search: "GoogleSearchTool", 
     checkpointer: Any = None
 ):
     """